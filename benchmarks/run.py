@@ -0,0 +1,213 @@
+# Import native libraries
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Import project code
+from benchmarks.synthetic import SyntheticCorpusGenerator, StubConnector
+from grimoire.core.corpus import Corpus
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Metrics where a larger number is an improvement; everything else is a time or a size
+HIGHER_IS_BETTER = {"documents_per_second", "tokens_per_second", "queries_per_second"}
+
+
+def measure(func, repeat=1):
+    timings = []
+    result = None
+
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    return result, min(timings), statistics.median(timings)
+
+
+def build_corpus(generator, latency):
+    corpus = Corpus(StubConnector(generator, latency))
+    corpus.add_documents(generator.document_ids, "domain", "username", "password")
+    return corpus
+
+
+def bench_ingestion(generator, args):
+    _, best, median = measure(lambda: build_corpus(generator, args.latency), args.repeat)
+    return {
+        "seconds": best,
+        "median_seconds": median,
+        "documents_per_second": generator.num_documents / best,
+    }
+
+
+def bench_nlp(generator, args):
+    corpus = build_corpus(generator, 0.0)
+    sample = corpus.random_sample(min(args.nlp_documents, len(corpus.documents)), seed=generator.seed)
+
+    def extract():
+        for doc in sample:
+            doc.extract_features()
+
+    _, best, median = measure(extract, args.repeat)
+    tokens = sum(len(doc.features.orth) for doc in sample)
+    return {
+        "seconds": best,
+        "median_seconds": median,
+        "documents_per_second": len(sample) / best,
+        "tokens_per_second": tokens / best,
+    }
+
+
+def bench_search(generator, args):
+    corpus = build_corpus(generator, 0.0)
+    queries = generator.vocabulary[:: max(1, len(generator.vocabulary) // args.queries)][:args.queries]
+
+    # The result cache is cleared each round so every round measures cold scans
+    def search():
+        corpus.searches.clear()
+        for query in queries:
+            corpus.search_corpus(query)
+
+    def search_many():
+        corpus.searches.clear()
+        corpus.search_many(queries)
+
+    _, best, median = measure(search, args.repeat)
+    _, many_best, _ = measure(search_many, args.repeat)
+    return {
+        "seconds": best,
+        "median_seconds": median,
+        "seconds_per_query": best / len(queries),
+        "queries_per_second": len(queries) / best,
+        "batched_seconds": many_best,
+    }
+
+
+def bench_save_load(generator, args):
+    corpus = build_corpus(generator, 0.0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "corpus.pkl")
+        _, save_seconds, _ = measure(lambda: corpus.save_corpus(path), args.repeat)
+        _, load_seconds, _ = measure(lambda: Corpus.load_corpus(path), args.repeat)
+        size = os.path.getsize(path)
+
+    return {"save_seconds": save_seconds, "load_seconds": load_seconds, "file_bytes": size}
+
+
+def bench_memory(generator, args):
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        corpus = build_corpus(generator, 0.0)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"peak_bytes": peak, "retained_bytes": current, "bytes_per_document": current / max(1, len(corpus.documents))}
+
+
+SCENARIOS = {
+    "ingestion": bench_ingestion,
+    "nlp": bench_nlp,
+    "search": bench_search,
+    "save_load": bench_save_load,
+    "memory": bench_memory,
+}
+
+
+def compare(results, baseline, tolerance):
+    comparison = {}
+
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get("results", {}).get(scenario, {}).get(metric)
+
+            if not previous or not isinstance(value, (int, float)):
+                continue
+
+            ratio = value / previous
+            higher_is_better = metric in HIGHER_IS_BETTER
+            regressed = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+            comparison[f"{scenario}.{metric}"] = {
+                "baseline": previous,
+                "current": value,
+                "ratio": ratio,
+                "regression": regressed,
+            }
+
+    return comparison
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run Grimoire benchmarks on a synthetic corpus")
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--mean-length", type=int, default=500)
+    parser.add_argument("--length-distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Stub connector latency per request in seconds")
+    parser.add_argument("--nlp-documents", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--output", help="Write results JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown before flagging")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    generator = SyntheticCorpusGenerator(
+        args.documents, args.mean_length, args.length_distribution, args.vocabulary, seed=args.seed
+    )
+
+    results = {}
+    for scenario in args.scenarios:
+        logger.info(f"Running benchmark scenario: {scenario}")
+        results[scenario] = SCENARIOS[scenario](generator, args)
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform()},
+        "config": dict(generator.config(), latency=args.latency, repeat=args.repeat),
+        "results": results,
+    }
+
+    exit_code = 0
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(results, json.load(f), args.tolerance)
+
+        regressions = [name for name, entry in report["comparison"].items() if entry["regression"]]
+        if regressions:
+            logger.warning(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            exit_code = 1
+
+    text = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+# Import native libraries
+import random
+import string
+import time
+from datetime import datetime, timedelta
+
+# Import project code
+from grimoire.core.connectors import DoclinkConnector, DocumentTooLargeError
+from grimoire.core.scheduling import BULK
+
+DOC_TYPES = ["Memo", "Letter", "Contract", "Report", "Email"]
+AUTHORS = ["alice", "bob", "carol", "dave", "erin", "frank"]
+
+
+class SyntheticCorpusGenerator:
+    def __init__(self, num_documents=1000, mean_length=500, length_distribution="lognormal",
+                 vocabulary_size=5000, zipf_exponent=1.1, seed=0):
+        self.num_documents = num_documents
+        self.mean_length = mean_length
+        self.length_distribution = length_distribution
+        self.vocabulary_size = vocabulary_size
+        self.zipf_exponent = zipf_exponent
+        self.seed = seed
+
+        rng = random.Random(seed)
+        self.vocabulary = self.__make_vocabulary(rng, vocabulary_size)
+        # Zipfian word frequencies look far more like real text than uniform draws
+        self.weights = [1.0 / (rank ** zipf_exponent) for rank in range(1, vocabulary_size + 1)]
+        self.document_ids = [f"DOC{i:08d}" for i in range(num_documents)]
+        self.__index = {document_id: i for i, document_id in enumerate(self.document_ids)}
+
+    @staticmethod
+    def __make_vocabulary(rng, size):
+        words = set()
+        while len(words) < size:
+            words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 12))))
+        return sorted(words)
+
+    def config(self):
+        return {
+            "num_documents": self.num_documents,
+            "mean_length": self.mean_length,
+            "length_distribution": self.length_distribution,
+            "vocabulary_size": self.vocabulary_size,
+            "zipf_exponent": self.zipf_exponent,
+            "seed": self.seed,
+        }
+
+    def __rng(self, document_id, salt):
+        # Seeded per document so any single document can be regenerated on demand
+        return random.Random(f"{self.seed}:{salt}:{document_id}")
+
+    def length(self, rng):
+        if self.length_distribution == "fixed":
+            return self.mean_length
+        elif self.length_distribution == "uniform":
+            return rng.randint(1, 2 * self.mean_length)
+        elif self.length_distribution == "lognormal":
+            return max(1, int(rng.lognormvariate(0, 1) * self.mean_length / 1.6487))
+        raise ValueError(f"Unknown length distribution: {self.length_distribution}")
+
+    def text(self, document_id):
+        rng = self.__rng(document_id, "text")
+        words = rng.choices(self.vocabulary, weights=self.weights, k=self.length(rng))
+        sentences = []
+
+        for start in range(0, len(words), 15):
+            sentence = " ".join(words[start:start + 15])
+            sentences.append(sentence[:1].upper() + sentence[1:] + ".")
+
+        return " ".join(sentences)
+
+    def metadata(self, document_id):
+        rng = self.__rng(document_id, "metadata")
+        created = datetime(2015, 1, 1) + timedelta(days=rng.randint(0, 3000))
+        return {
+            "id": document_id,
+            "doc_type": rng.choice(DOC_TYPES),
+            "author": rng.choice(AUTHORS),
+            "created": created.isoformat(),
+            "pages": rng.randint(1, 200),
+        }
+
+    def __contains__(self, document_id):
+        return document_id in self.__index
+
+
+class StubConnector(DoclinkConnector):
+    def __init__(self, generator, latency=0.0, jitter=0.0, seed=0):
+        super().__init__()
+        self.generator = generator
+        self.latency = latency
+        self.jitter = jitter
+        self.__rng = random.Random(seed)
+
+    def __sleep(self):
+        delay = self.latency + self.__rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_access_token(self, domain, username, password):
+        self.__sleep()
+        return "stub-token"
+
+    def get_document_metadata(self, unique_id, token, priority=BULK):
+        self.__sleep()
+        return self.generator.metadata(unique_id)
+
+    def get_document_text(self, unique_id, token, priority=BULK):
+        self.__sleep()
+        return self.generator.text(unique_id)
+
+    def stream_document_text(self, unique_id, token, sink, max_bytes=None, priority=BULK):
+        self.__sleep()
+        data = self.generator.text(unique_id).encode("utf-8")
+        if max_bytes is not None and len(data) > max_bytes:
+            raise DocumentTooLargeError(f"Text of document {unique_id} exceeds the {max_bytes} byte limit")
+        sink.write(data)
+        return len(data)
@@ -1,23 +1,85 @@
 # Import native libraries
+import codecs
 import logging
+import zlib
 
 # Import third-party libraries
 import requests
-from requests.exceptions import RequestException
-from retry import retry
+from requests.exceptions import ChunkedEncodingError, ConnectionError, ContentDecodingError, RequestException
+from urllib3.exceptions import DecodeError, HTTPError as Urllib3Error, ProtocolError, ReadTimeoutError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Import project code
 from grimoire.config import CLIENT_ID, IDA_URL, RESOURCE, DOCLINK_METADATA_URL, DOCLINK_TEXT_URL
+from grimoire.core.metrics import metrics
+from grimoire.core.scheduling import BULK, INTERACTIVE, RequestScheduler
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+CHUNK_SIZE = 64 * 1024
+
+# Only brotli releases with output_buffer_limit can inflate a chunk a bounded step at a time;
+# with older ones br is not advertised, so Doclink falls back to gzip
+BROTLI_BOUNDED = brotli is not None and hasattr(brotli.Decompressor, "can_accept_more_data")
+
+
+class DocumentTooLargeError(ValueError):
+    pass
+
+
+class _Decoder:
+    # Undoes the content-encoding one chunk at a time, inflating at most about
+    # CHUNK_SIZE bytes per step so a small compressed body cannot balloon in memory
+    def __init__(self, encoding):
+        encoding = (encoding or "identity").strip().lower()
+
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # wbits 47 accepts both gzip and zlib headers
+            self.__zlib = zlib.decompressobj(47)
+            self.__brotli = None
+        elif encoding == "br":
+            if not BROTLI_BOUNDED:
+                raise ValueError("Doclink sent a brotli encoded body, install brotli 1.2 or later to read it: pip install -U brotli")
+            self.__zlib = None
+            self.__brotli = brotli.Decompressor()
+        elif encoding == "identity":
+            self.__zlib = None
+            self.__brotli = None
+        else:
+            raise ValueError(f"Unsupported content encoding: {encoding}")
+
+    def decode(self, chunk):
+        if self.__brotli is not None:
+            # Input that would inflate past the limit is held back and drained with empty calls
+            # until the decompressor needs more input
+            output = self.__brotli.process(chunk, output_buffer_limit=CHUNK_SIZE)
+            while output:
+                yield output
+                output = self.__brotli.process(b"", output_buffer_limit=CHUNK_SIZE)
+        elif self.__zlib is not None:
+            while chunk:
+                yield self.__zlib.decompress(chunk, CHUNK_SIZE)
+                chunk = self.__zlib.unconsumed_tail
+        else:
+            yield chunk
+
+    def flush(self):
+        if self.__zlib is not None:
+            yield self.__zlib.flush()
+
 
 class DoclinkConnector:
-    def __init__(self):
+    def __init__(self, scheduler=None):
+        # The default keeps the old three attempts with 2s/4s backoff, now jittered, unthrottled and
+        # without a circuit breaker
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
         logging.info("Created new DoclinkConnector instance")
 
-    @retry(RequestException, tries=3, delay=2, backoff=2)
     def get_access_token(self, domain, username, password):
             url = IDA_URL
             payload = {
@@ -27,48 +89,162 @@ class DoclinkConnector:
                  "password": password,
                  "resource": RESOURCE
             }
-            response = requests.post(url, payload)
-            response.raise_for_status()
+            response = self._send("token", INTERACTIVE, requests.post, url, payload)
             
             return response.json()["access_token"]
     
-    @retry(RequestException, tries=3, delay=2, backoff=2)
-    def get_document_metadata(self, unique_id, token):
+    def get_document_metadata(self, unique_id, token, priority=BULK):
         url = f"{DOCLINK_METADATA_URL}".format(unique_id)
         payload = {}
         headers = {
             "Accept": "application/json",
             "Authorization": "Bearer" + token
         }
-        response = requests.get(url=url, headers=headers, data=payload)
-        response.raise_for_status()
+        response = self._send("metadata", priority, requests.get, url=url, headers=headers, data=payload)
         
         return response.json()
     
-    @retry(RequestException, tries=3, delay=2, backoff=2)
-    def get_document_text(self, unique_id, token):
+    def get_document_text(self, unique_id, token, priority=BULK):
         url = f"{DOCLINK_TEXT_URL}".format(unique_id)
         payload = {}
         headers = {
             "Content-Type": "application/json",
             "Authorization": "Bearer" + token
         }
-        response = requests.get(url=url, headers=headers, data=payload)
-        response.raise_for_status()
+        response = self._send("text", priority, requests.get, url=url, headers=headers, data=payload)
         
         return response.text
     
-    def process_batch(self, batch_ids, batch_num, num_batches, domain, username, password):
-        token = self.get_access_token(domain, username, password)
-        logging.info(f"Started processing batch {batch_num}/{num_batches}")
-        
+    def stream_document_text(self, unique_id, token, sink, max_bytes=None, priority=BULK):
+        # Writes the text to a binary file object as UTF-8 and returns the number of bytes written
+        url = f"{DOCLINK_TEXT_URL}".format(unique_id)
+        headers = {
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip, deflate, br" if BROTLI_BOUNDED else "gzip, deflate",
+            "Authorization": "Bearer" + token
+        }
+        return self.scheduler.call(self._stream_attempt, unique_id, url, headers, sink, max_bytes, priority=priority)
+
+    def save_document_text(self, unique_id, token, texts, priority=BULK):
+        # texts is a store with a writer, such as DiskTextStore; its max_bytes caps each document
+        with texts.writer(unique_id) as sink:
+            return self.stream_document_text(unique_id, token, sink, texts.max_bytes, priority)
+
+    def fetch_document(self, unique_id, token, priority=INTERACTIVE):
+        return self.get_document_metadata(unique_id, token, priority), self.get_document_text(unique_id, token, priority)
+
+    def _send(self, endpoint, priority, method, *args, **kwargs):
+        return self.scheduler.call(self._attempt, endpoint, method, *args, priority=priority, **kwargs)
+
+    def _attempt(self, endpoint, method, *args, **kwargs):
+        # Runs once per attempt, so failures counted here include the ones that are retried
+        metrics.inc("http_requests_total", endpoint=endpoint)
+
+        try:
+            with metrics.timer("http_request_seconds", endpoint=endpoint):
+                response = method(*args, **kwargs)
+                response.raise_for_status()
+        except RequestException:
+            metrics.inc("http_failures_total", endpoint=endpoint)
+            raise
+
+        if metrics.enabled:
+            metrics.inc("http_bytes_total", len(response.content), endpoint=endpoint)
+
+        return response
+
+    def _stream_attempt(self, unique_id, url, headers, sink, max_bytes):
+        metrics.inc("http_requests_total", endpoint="text")
+        # A retried attempt starts the file over
+        sink.seek(0)
+        sink.truncate()
+
+        try:
+            with metrics.timer("http_request_seconds", endpoint="text"):
+                with requests.get(url=url, headers=headers, stream=True) as response:
+                    response.raise_for_status()
+                    written = self._write_body(unique_id, response, sink, max_bytes)
+        except RequestException:
+            metrics.inc("http_failures_total", endpoint="text")
+            raise
+
+        metrics.inc("http_bytes_total", written, endpoint="text")
+        return written
+
+    def _write_body(self, unique_id, response, sink, max_bytes):
+        decoder = _Decoder(response.headers.get("Content-Encoding"))
+        charset = codecs.lookup(response.encoding or "utf-8").name
+        # Non UTF-8 bodies are transcoded incrementally so the store only ever holds UTF-8
+        transcoder = None if charset == "utf-8" else codecs.getincrementaldecoder(charset)(errors="replace")
+        written = 0
+
+        def write(data, final=False):
+            nonlocal written
+            if transcoder is not None:
+                data = transcoder.decode(data, final).encode("utf-8")
+            written += len(data)
+            if max_bytes is not None and written > max_bytes:
+                raise DocumentTooLargeError(f"Text of document {unique_id} exceeds the {max_bytes} byte limit")
+            sink.write(data)
+
+        for chunk in self._raw_chunks(response):
+            for data in decoder.decode(chunk):
+                write(data)
+
+        for data in decoder.flush():
+            write(data)
+        write(b"", final=True)
+
+        return written
+
+    @staticmethod
+    def _raw_chunks(response):
+        # The body is read undecoded so _Decoder can bound inflation. Reading raw skips the
+        # wrapping iter_content does, so urllib3 errors are mapped the same way here and a
+        # connection dropped mid-body is retried like any other request failure.
+        try:
+            yield from response.raw.stream(CHUNK_SIZE, decode_content=False)
+        except ProtocolError as e:
+            raise ChunkedEncodingError(e)
+        except DecodeError as e:
+            raise ContentDecodingError(e)
+        except ReadTimeoutError as e:
+            raise ConnectionError(e)
+        except Urllib3Error as e:
+            raise RequestException(e)
+
+    def fetch_batch(self, batch_ids, token, texts=None):
+        # A document that fails or is over the size cap is skipped on its own, the rest are kept
+        fetched_ids = []
         batch_metadata = []
         batch_contents = []
 
-        try:
-            batch_metadata = [self.get_document_metadata(document_id, token) for document_id in batch_ids]
-            batch_contents = [self.get_document_text(document_id, token) for document_id in batch_ids]
-        except Exception as e:
-            logging.error(f"Exception occurred while downloading batch {batch_num}: {e}")
+        for document_id in batch_ids:
+            try:
+                metadata = self.get_document_metadata(document_id, token)
+                if texts is not None:
+                    # Streamed texts go straight to the store and are not returned
+                    self.save_document_text(document_id, token, texts)
+                    content = None
+                else:
+                    content = self.get_document_text(document_id, token)
+            except DocumentTooLargeError as e:
+                logging.warning(f"Skipped document {document_id}: {e}")
+                metrics.inc("documents_skipped_total", reason="too_large")
+                continue
+            except Exception as e:
+                logging.error(f"Exception occurred while downloading document {document_id}: {e}")
+                metrics.inc("documents_skipped_total", reason="error")
+                continue
 
-        return batch_ids, batch_metadata, batch_contents
+            fetched_ids.append(document_id)
+            batch_metadata.append(metadata)
+            batch_contents.append(content)
+
+        return fetched_ids, batch_metadata, batch_contents
+
+    def process_batch(self, batch_ids, batch_num, num_batches, domain, username, password, texts=None):
+        token = self.get_access_token(domain, username, password)
+        logging.info(f"Started processing batch {batch_num}/{num_batches}")
+        
+        return self.fetch_batch(batch_ids, token, texts)
@@ -1,52 +1,72 @@
 # Import native libraries
 import concurrent.futures
 import logging
-import os
 import pickle
-import random
+import time
 import uuid
 from datetime import datetime
+from functools import partial
 
 # Import project code
 from grimoire.core.connectors import DoclinkConnector
-from grimoire.core.document import Document
+from grimoire.core.document import Document, IngestBatch, current_user
+from grimoire.core.entities import EntityIndex
+from grimoire.core.matrix import FeatureMatrixBuilder
+from grimoire.core.metadata import CorpusView, MetadataStore, document_version
+from grimoire.core.metrics import metrics
+from grimoire.core.persistence import open_log
+from grimoire.core.pipeline import ExtractFeatures, Fetch, Pipeline, Stage
+from grimoire.core.sampling import reservoir_sample, stratified_sample
+from grimoire.core.search import SearchCache, scan
+from grimoire.core.storage import CompressedTextStore, DiskTextStore, DocumentStore
+from grimoire.core.vocab import Vocab
+from grimoire.nlp.features import Features
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
 class Corpus:
-    def __init__(self, connector = DoclinkConnector):
+    def __init__(self, connector = DoclinkConnector, store=None):
         self.id = uuid.uuid4()
-        self.created_by = os.getlogin()
+        self.created_by = current_user()
         self.created_date = datetime.now()
         self.documents = []
         self.connector = connector
+        self.vocab = Vocab(Features.nlp.Defaults.stop_words)
+        self.metadata = MetadataStore(self.vocab.strings)
+        self.store = store if store is not None else DocumentStore()
+        self.versions = {}
+        self.entities = EntityIndex(self.vocab.strings)
+        self.searches = SearchCache()
 
         self.__id_to_index = {}
         
         logger.info("Created new Corpus instance")
 
     def add_documents(self, document_ids, domain, username, password):
+        start = time.perf_counter()
         BATCH_SIZE = max(1, len(document_ids) // 100)
         num_batches = len(document_ids) // BATCH_SIZE
 
         all_documents = []
+        batch = IngestBatch()
+        # Connectors only get a texts store when streaming is on, so ones written against
+        # process_batch(batch_ids, batch_num, num_batches, domain, username, password) keep working
+        texts = (self.store.texts,) if self.store.streams_text else ()
 
         with concurrent.futures.ThreadPoolExecutor() as executor:
             futures = []
         
             for i in range(num_batches):
-                start = i * BATCH_SIZE
-                end = (i + 1) * BATCH_SIZE
-                batch_ids = document_ids[start:end]
-                futures.append(executor.submit(self.connector.process_batch, batch_ids, i + 1, num_batches, domain, username, password))
+                batch_ids = document_ids[i * BATCH_SIZE:(i + 1) * BATCH_SIZE]
+                futures.append(executor.submit(self.connector.process_batch, batch_ids, i + 1, num_batches, domain, username, password, *texts))
 
             for future in concurrent.futures.as_completed(futures):
                 batch_ids, batch_metadata, batch_contents = future.result()
 
                 for i in range(len(batch_ids)):
-                    all_documents.append(Document(batch_ids[i], batch_contents[i], batch_metadata[i]))
+                    all_documents.append(Document(batch_ids[i], batch_contents[i], batch_metadata[i], self.vocab, batch, self.store))
 
         remaining_ids = document_ids[num_batches * BATCH_SIZE:]
 
@@ -54,21 +74,189 @@ class Corpus:
             logger.info("Started processing remaining documents")
             token = self.connector.get_access_token(domain, username, password)
             
-            try:
-                remaining_metadata = [self.connector.get_document_metadata(remaining_id, token) for remaining_id in remaining_ids]
-                remaining_content = [self.connector.get_document_text(remaining_id, token) for remaining_id in remaining_ids]
+            if hasattr(self.connector, "fetch_batch"):
+                remaining_ids, remaining_metadata, remaining_content = self.connector.fetch_batch(remaining_ids, token, *texts)
+            else:
+                remaining_ids, remaining_metadata, remaining_content = self.__fetch_each(remaining_ids, token)
 
-                for i in range(len(remaining_ids)):
-                    all_documents.append(Document(remaining_ids[i], remaining_content[i], remaining_metadata[i]))
-            except Exception as e:
-                logger.error(f"Error occurred while downloading remaining documents")
+            for i in range(len(remaining_ids)):
+                all_documents.append(Document(remaining_ids[i], remaining_content[i], remaining_metadata[i], self.vocab, batch, self.store))
+
+        skipped = len(document_ids) - len(all_documents)
+        if skipped:
+            fetched = {doc.id for doc in all_documents}
+            logger.warning(f"Skipped {skipped} documents that could not be downloaded: {[i for i in document_ids if i not in fetched]}")
 
         logger.info("All documents have been downloaded and added to the corpus")
 
-        self.documents.extend(all_documents)
+        self.__append_documents(all_documents)
+        self.__record_throughput("ingest", len(all_documents), start)
+
+    def __fetch_each(self, document_ids, token):
+        # For connectors without fetch_batch; a document that fails is skipped on its own
+        fetched_ids, batch_metadata, batch_contents = [], [], []
+
+        for document_id in document_ids:
+            try:
+                metadata = self.connector.get_document_metadata(document_id, token)
+                content = self.connector.get_document_text(document_id, token)
+            except Exception as e:
+                logger.error(f"Error occurred while downloading document {document_id}: {e}")
+                continue
+
+            fetched_ids.append(document_id)
+            batch_metadata.append(metadata)
+            batch_contents.append(content)
+
+        return fetched_ids, batch_metadata, batch_contents
+
+    def ingest(self, document_ids, domain, username, password, cache_dir=None, fetch_workers=8, nlp_workers=None, queue_size=64):
+        start = time.perf_counter()
+        # Fetching runs on threads and feature extraction on processes, connected by bounded queues.
+        # Only the deterministic NLP stage is cached; fetches always go back to Doclink.
+        model = Features.nlp.meta
+        texts = self.store.texts if self.store.streams_text else None
+        stages = [
+            Stage("fetch", Fetch(self.connector, domain, username, password, texts), "thread", fetch_workers,
+                  {"connector": type(self.connector).__name__}, cache=False),
+            Stage("features", ExtractFeatures(texts), "process", nlp_workers,
+                  {"model": model.get("name"), "version": model.get("version")}),
+        ]
+        records = Pipeline(stages, queue_size, cache_dir).run(document_ids)
+
+        batch = IngestBatch()
+        all_documents = []
+
+        for record in records:
+            doc = Document(record["id"], record["text"], record["attributes"], self.vocab, batch, self.store)
+            doc.features = record["features"].rebind(self.vocab)
+            self.entities.add(doc.id, doc.features.entities)
+            all_documents.append(doc)
+
+        logger.info(f"Ingested {len(all_documents)} of {len(document_ids)} documents through the pipeline")
+
+        self.__append_documents(all_documents)
+        self.__record_throughput("ingest", len(all_documents), start)
+
+    def __append_documents(self, all_documents):
+        # Metadata goes first, so a row that cannot be stored never leaves a document without one
+        for doc in all_documents:
+            attributes = doc.attributes
+            self.metadata.append(attributes)
+            self.versions[doc.id] = document_version(attributes)
+            self.__id_to_index[doc.id] = len(self.documents)
+            self.documents.append(doc)
+
+        self.searches.add_documents(all_documents)
+
+    def refresh(self, domain, username, password, document_ids=None, prune=False, max_workers=8):
+        # Only metadata is fetched for every document; text is downloaded for changed ones only
+        start = time.perf_counter()
+        current_ids = list(self.__id_to_index)
+        document_ids = current_ids if document_ids is None else list(document_ids)
+        requested = set(document_ids)
+
+        known_ids = [document_id for document_id in document_ids if document_id in self.__id_to_index]
+        new_ids = [document_id for document_id in document_ids if document_id not in self.__id_to_index]
+        stale_ids = [document_id for document_id in current_ids if document_id not in requested] if prune else []
+
+        token = self.connector.get_access_token(domain, username, password)
+        changed = {}
+        failed = []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {
+                executor.submit(self.connector.get_document_metadata, document_id, token): document_id
+                for document_id in known_ids
+            }
+
+            for future in concurrent.futures.as_completed(futures):
+                document_id = futures[future]
+
+                try:
+                    attributes = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to refresh metadata for document {document_id}: {e}")
+                    failed.append(document_id)
+                    continue
+
+                if document_version(attributes) != self.versions.get(document_id):
+                    changed[document_id] = attributes
+
+            if self.store.streams_text:
+                fetch_text = partial(self.connector.save_document_text, texts=self.store.texts)
+            else:
+                fetch_text = self.connector.get_document_text
+            texts = {executor.submit(fetch_text, document_id, token): document_id for document_id in changed}
+
+            for future in concurrent.futures.as_completed(texts):
+                document_id = texts[future]
+
+                try:
+                    text = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to refresh text for document {document_id}: {e}")
+                    failed.append(document_id)
+                    del changed[document_id]
+                    continue
+
+                row = self.__id_to_index[document_id]
+                doc = self.documents[row]
+                if not self.store.streams_text:
+                    doc.text = text
+                self.__set_attributes(row, changed[document_id])
+
+        self.__invalidate(list(changed))
+
+        if new_ids:
+            self.add_documents(new_ids, domain, username, password)
+
+        if stale_ids:
+            self.remove_documents(stale_ids)
+
+        summary = {
+            "checked": len(known_ids),
+            "changed": len(changed),
+            "added": len(new_ids),
+            "removed": len(stale_ids),
+            "failed": len(failed),
+        }
+        logger.info(f"Refreshed corpus: {summary}")
 
-        for i, doc in enumerate(all_documents):
-            self.__id_to_index[doc.id] = len(self.documents) - len(all_documents) + i
+        metrics.inc("refresh_checked_total", len(known_ids))
+        metrics.inc("refresh_changed_total", len(changed))
+        self.__record_throughput("refresh", len(known_ids), start)
+
+        return summary
+
+    def set_attributes(self, document_id, attributes):
+        # Setting Document.attributes alone would leave the metadata columns and the version behind,
+        # so filters would miss the change and the next save_segments would not write it
+        row = self.__id_to_index.get(document_id)
+
+        if row is None:
+            raise KeyError(f"No document found with ID: {document_id}")
+
+        self.__set_attributes(row, attributes)
+
+    def __set_attributes(self, row, attributes):
+        doc = self.documents[row]
+        doc.attributes = attributes
+        self.metadata.update(row, attributes)
+        self.versions[doc.id] = document_version(attributes)
+
+    def __invalidate(self, document_ids):
+        # Drop everything derived from these documents' text so it is rebuilt on demand
+        if not document_ids:
+            return
+
+        self.store.remove_features(document_ids)
+        self.entities.remove(document_ids)
+
+        # Cached searches drop the old texts and rescan the new ones
+        self.searches.remove_documents(document_ids)
+        self.searches.add_documents([self.documents[self.__id_to_index[document_id]] for document_id in document_ids])
+        logger.info(f"Invalidated derived data for {len(document_ids)} documents")
     
     def get_document_by_id(self, document_id):
         if document_id in self.__id_to_index:
@@ -78,18 +266,220 @@ class Corpus:
             return None
         
     def remove_documents(self, document_ids):
-        self.documents = [doc for doc in self.documents if doc.id not in document_ids]
+        removed_ids = set(document_ids)
+        kept_rows = [i for i, doc in enumerate(self.documents) if doc.id not in removed_ids]
+        self.documents = [self.documents[i] for i in kept_rows]
+        self.metadata = self.metadata.take(kept_rows)
+        self.store.remove(removed_ids)
+        self.entities.remove(removed_ids)
+        self.searches.remove_documents(removed_ids)
+
+        for document_id in removed_ids:
+            self.versions.pop(document_id, None)
+
         self.__id_to_index = {id: i for i, id in enumerate(doc.id for doc in self.documents)}
         logger.info(f"Successfully removed documents from corpus: {document_ids}")
 
+    def __record_throughput(self, stage, num_documents, start):
+        if not metrics.enabled:
+            return
+
+        elapsed = time.perf_counter() - start
+        metrics.inc(f"{stage}_documents_total", num_documents)
+        metrics.observe(f"{stage}_seconds", elapsed)
+
+        if elapsed > 0:
+            metrics.set(f"{stage}_documents_per_second", num_documents / elapsed)
+
+        metrics.record_memory()
+
+    def extract_features(self, document_ids=None, n_process=1, batch_size=4):
+        # n_process worker processes parse the windows of each long document in batches of batch_size
+        start = time.perf_counter()
+        documents = self.documents if document_ids is None else [self.documents[self.__id_to_index[i]] for i in document_ids]
+
+        # The entity index is filled as each document is processed
+        for doc in documents:
+            doc.extract_features(n_process, batch_size)
+            self.entities.add(doc.id, doc.features.entities)
+
+        logger.info(f"Extracted features for {len(documents)} documents")
+        self.__record_throughput("features", len(documents), start)
+
+    def compress_texts(self, level=3, dict_size=112640, cache_size=1024, sample_size=2000, seed=None):
+        texts = CompressedTextStore(level, dict_size, cache_size)
+        samples = reservoir_sample(self.store.texts.values(), sample_size, seed)
+        texts.train(samples)
+        self.store.use_texts(texts)
+        logger.info(f"Compressed {len(texts)} document texts, ratio {texts.compression_ratio():.1f}x")
+
+    def store_texts_on_disk(self, directory, max_bytes=None):
+        # From here on document texts are streamed from Doclink straight to files
+        texts = DiskTextStore(directory, max_bytes)
+        self.store.use_texts(texts)
+        logger.info(f"Moved {len(texts)} document texts to {directory}")
+
+    def get_features(self, blocks=("flags", "tfidf"), metadata=(), label=None, output="sparse", chunk_size=1000,
+                     cache_dir=None, **options):
+        # Documents without extracted features contribute empty token and entity blocks
+        builder = FeatureMatrixBuilder(blocks, metadata, label, output, chunk_size, **options)
+        return builder.build(self, cache_dir)
+
+    def encode_subwords(self, model, directory, max_length=512, stride=128, batch_size=64, shard_size=4096):
+        # Model-ready input IDs and attention masks, written once and memory-mapped by training code.
+        # Imported here so loading a corpus does not pull in transformers.
+        from grimoire.nlp.subword import SubwordTokenizer
+
+        tokenizer = SubwordTokenizer(model, max_length, stride, batch_size)
+        return tokenizer.encode_corpus(self.documents, directory, shard_size)
+
+    def create_index(self, field, kind="hash"):
+        self.metadata.create_index(field, kind)
+        logger.info(f"Created {kind} index on metadata field: {field}")
+
+    def filter(self, **conditions):
+        return CorpusView(self, self.metadata.query(**conditions))
+
     def search_corpus(self, query):
-        return [doc for doc in self.documents if query.lower() in doc.content.lower()]
+        return self.search_many([query])[query]
+
+    def search_many(self, queries):
+        # Cached queries are answered from the cache, the rest together in a single pass
+        queries = list(dict.fromkeys(queries))
+        folded = {query: query.lower() for query in queries}
+        results = {}
+        misses = []
+
+        for query, key in folded.items():
+            document_ids = self.searches.get(key)
+            if document_ids is None:
+                misses.append(key)
+            else:
+                results[key] = document_ids
+
+        if misses:
+            for key, document_ids in scan(self.documents, misses).items():
+                self.searches.put(key, document_ids)
+                results[key] = document_ids
+
+        metrics.inc("search_queries_total", len(queries))
+        metrics.inc("search_cache_hits_total", len(queries) - len(set(misses)))
+
+        return {
+            query: [self.documents[row] for row in sorted(self.__id_to_index[document_id] for document_id in results[key])]
+            for query, key in folded.items()
+        }
     
-    def random_sample(self, n):
-        return random.sample(self.documents, n)
+    def random_sample(self, n, seed=None):
+        return reservoir_sample(self.documents, n, seed)
+
+    def stratified_sample(self, field, n, seed=None, proportional=True):
+        rows = stratified_sample(range(len(self.documents)), lambda row: self.metadata.get(row, field), n, seed, proportional)
+        return [self.documents[row] for row in sorted(rows)]
+
+    def add_sample(self, document_ids, n, domain, username, password, seed=None):
+        # Sample the ID list first so only the sampled documents are downloaded
+        sample_ids = reservoir_sample(document_ids, n, seed)
+        logger.info(f"Sampled {len(sample_ids)} document IDs for download")
+        self.add_documents(sample_ids, domain, username, password)
+        return sample_ids
+
+    def __signature(self, doc):
+        # Changes when a document is re-fetched or its features are extracted again
+        return (self.versions.get(doc.id), self.store.features_revision(doc.id))
+
+    def save_segments(self, directory, wait=False, compact=False):
+        # Appends what changed since the last save as a new segment, written on a background
+        # thread. The first save to a directory, or compact=True, writes a full base instead.
+        log = open_log(directory)
+        current = {doc.id: self.__signature(doc) for doc in self.documents}
+
+        since = log.pending
+
+        if compact or since is None or log.corpus_id != str(self.id):
+            # Pickled here rather than on the writer thread so the snapshot is consistent
+            data = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+            log.submit(log.write_base(self.id, data, current), wait)
+            return
+
+        changed = [doc for doc in self.documents if since.get(doc.id) != current[doc.id]]
+        removed = [document_id for document_id in since if document_id not in current]
+
+        if not changed and not removed:
+            return
+
+        # Streamed texts are already on disk, so segments only point at them
+        streamed = self.store.streams_text
+        records = [
+            (doc.id, None if streamed else doc.text, doc.attributes, doc.batch, self.store.get_features(doc.id))
+            for doc in changed
+        ]
+
+        def build():
+            # Segment features get a small vocab of their own instead of a copy of the corpus one
+            vocab = Vocab(Features.nlp.Defaults.stop_words)
+            documents = [
+                (document_id, text, attributes, batch, features.rebind(vocab) if features is not None else None)
+                for document_id, text, attributes, batch, features in records
+            ]
+            return {"corpus": str(self.id), "removed": removed, "documents": documents}
+
+        job = log.write_segment(build, since, current)
+
+        if job is None:
+            # A write failed while this segment was being prepared, so start over from a full base
+            return self.save_segments(directory, wait, compact=True)
+
+        log.submit(job, wait)
+        logger.info(f"Queued a segment with {len(records)} changed and {len(removed)} removed documents")
+
+    def compact_segments(self, directory, wait=True):
+        # Folds the base and every segment into a new base from the corpus in memory
+        self.save_segments(directory, wait, compact=True)
+
+    def __apply_segment(self, segment):
+        if segment["removed"]:
+            self.remove_documents(segment["removed"])
+
+        new_documents = []
+
+        for document_id, text, attributes, batch, features in segment["documents"]:
+            if text is None and self.store.streams_text:
+                self.store.texts.register(document_id)
+
+            row = self.__id_to_index.get(document_id)
+
+            if row is None:
+                doc = Document(document_id, text, attributes, self.vocab, batch, self.store)
+                new_documents.append(doc)
+            else:
+                doc = self.documents[row]
+                if text is not None:
+                    doc.text = text
+                self.__set_attributes(row, attributes)
+                self.__invalidate([document_id])
+
+            if features is not None:
+                doc.features = features.rebind(self.vocab)
+                self.entities.add(document_id, doc.features.entities)
+
+        self.__append_documents(new_documents)
+
+    @staticmethod
+    def load_segments(directory):
+        log = open_log(directory)
+        log.flush()
+        corpus, segments = log.read()
+
+        for segment in segments:
+            corpus.__apply_segment(segment)
+
+        log.restore(corpus.id, {doc.id: corpus.__signature(doc) for doc in corpus.documents})
+        logger.info(f"Loaded corpus from {directory}: base and {len(segments)} segments, {len(corpus.documents)} documents")
+        return corpus
 
-    def save_corpus(self):
-        with open(self.id, "wb") as f:
+    def save_corpus(self, filename=None):
+        with open(filename or str(self.id), "wb") as f:
             return pickle.dump(self, f)
 
     @staticmethod
@@ -1,19 +1,101 @@
 # Import native libraries
-import os
+import getpass
+import uuid
 from datetime import datetime
 
 # Import project code
 from grimoire.nlp.features import Features
 
 
+def current_user():
+    # os.getlogin() needs a controlling terminal, which daemons and containers lack
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):
+        return "unknown"
+
+
+class IngestBatch:
+    __slots__ = ("id", "added_by", "date_added")
+
+    def __init__(self):
+        self.id = uuid.uuid4()
+        self.added_by = current_user()
+        self.date_added = str(datetime.now())
+
+
+class Attributes(dict):
+    # A decoded copy of a document's metadata. Changes to it would never reach the document or
+    # the corpus metadata, so they raise instead; Corpus.set_attributes changes both.
+    def __read_only(self, *args, **kwargs):
+        raise TypeError("Document attributes are read-only, use Corpus.set_attributes to change them")
+
+    __setitem__ = __delitem__ = __ior__ = __read_only
+    clear = pop = popitem = setdefault = update = __read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
 class Document:
-    def __init__(self, id, text, attributes):
+    __slots__ = ("id", "vocab", "batch", "_store", "_text", "_features", "_attributes")
+
+    def __init__(self, id, text, attributes, vocab=None, batch=None, store=None):
         self.id = id
-        self.date_added = str(datetime.now())
-        self.added_by = os.getlogin()
-        self.text = text
+        self.vocab = vocab if vocab is not None else Features.vocab
+        self.batch = batch if batch is not None else IngestBatch()
+        self._store = store
+        self._text = None
+        self._features = None
+        # A text streamed into the store beforehand arrives as None and is left in place
+        if text is not None:
+            self.text = text
         self.attributes = attributes
-        self.features = Features()    
 
-    def extract_features(self):
-        self.features = Features.extract_features(self.text)
+    @property
+    def date_added(self):
+        return self.batch.date_added
+
+    @property
+    def added_by(self):
+        return self.batch.added_by
+
+    # Text and features live in the corpus store when there is one and are read on access
+    @property
+    def text(self):
+        if self._store is not None:
+            return self._store.get_text(self.id)
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        if self._store is not None:
+            self._store.put_text(self.id, text)
+        else:
+            self._text = text
+
+    @property
+    def features(self):
+        features = self._store.get_features(self.id) if self._store is not None else self._features
+        return features if features is not None else Features(self.vocab)
+
+    @features.setter
+    def features(self, features):
+        if self._store is not None:
+            self._store.put_features(self.id, features)
+        else:
+            self._features = features
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            return Attributes()
+        return Attributes(self.vocab.strings.decode(self._attributes))
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = self.vocab.strings.encode(attributes)
+
+    def extract_features(self, n_process=1, batch_size=4):
+        # n_process and batch_size only matter for long texts, whose windows go through nlp.pipe
+        self.features = Features.extract_features(self.text, self.vocab, n_process, batch_size)
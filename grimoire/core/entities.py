@@ -0,0 +1,159 @@
+# Import native libraries
+import re
+from array import array
+from collections import Counter
+
+_WHITESPACE = re.compile(r"\s+")
+_LEADING_ARTICLE = re.compile(r"^(the|a|an)\s+")
+_EDGE_PUNCTUATION = re.compile(r"^[^\w]+|[^\w]+$")
+_POSSESSIVE = re.compile(r"['’]s$")
+
+
+def normalize_entity(text):
+    # "The  Acme Corp.'s" and "acme corp" group together
+    folded = _WHITESPACE.sub(" ", text.casefold()).strip()
+    norm = _POSSESSIVE.sub("", folded)
+    norm = _EDGE_PUNCTUATION.sub("", norm)
+    return _LEADING_ARTICLE.sub("", norm) or folded
+
+
+class EntityIndex:
+    # Postings are parallel append-only arrays; entity and document lookups point into them
+    def __init__(self, strings):
+        self.strings = strings
+        self.doc_ids = []
+
+        self.entity = array("L")
+        self.surface = array("L")
+        self.label = array("L")
+        self.doc = array("L")
+        self.start = array("L")
+        self.end = array("L")
+
+        self.postings = {}
+        self.counts = Counter()
+        self.label_counts = {}
+
+        self.__doc_number = {}
+        self.__doc_rows = {}
+        self.__dead = set()
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __contains__(self, text):
+        norm = normalize_entity(text)
+        return norm in self.strings and self.counts[self.strings[norm]] > 0
+
+    def add(self, document_id, entities):
+        if document_id in self.__doc_number and self.__doc_number[document_id] not in self.__dead:
+            self.remove([document_id])
+
+        number = len(self.doc_ids)
+        self.doc_ids.append(document_id)
+        self.__doc_number[document_id] = number
+        first = len(self.entity)
+
+        for text, start, end, label in entities:
+            norm_id = self.strings.add(normalize_entity(text))
+            label_id = self.strings.add(label)
+            row = len(self.entity)
+
+            self.entity.append(norm_id)
+            self.surface.append(self.strings.add(text))
+            self.label.append(label_id)
+            self.doc.append(number)
+            self.start.append(start)
+            self.end.append(end)
+
+            self.postings.setdefault(norm_id, array("L")).append(row)
+            self.counts[norm_id] += 1
+            self.label_counts.setdefault(norm_id, Counter())[label_id] += 1
+
+        self.__doc_rows[number] = (first, len(self.entity))
+
+    def remove(self, document_ids):
+        for document_id in document_ids:
+            number = self.__doc_number.pop(document_id, None)
+            if number is None or number in self.__dead:
+                continue
+
+            self.__dead.add(number)
+            first, last = self.__doc_rows[number]
+
+            for row in range(first, last):
+                norm_id = self.entity[row]
+                self.counts[norm_id] -= 1
+                self.label_counts[norm_id][self.label[row]] -= 1
+
+        if len(self.__dead) * 2 > len(self.doc_ids):
+            self.compact()
+
+    def __rows(self, text, label=None):
+        norm = normalize_entity(text)
+        if norm not in self.strings:
+            return []
+
+        label_id = self.strings[label] if label is not None and label in self.strings else None
+        if label is not None and label_id is None:
+            return []
+
+        return [
+            row for row in self.postings.get(self.strings[norm], ())
+            if self.doc[row] not in self.__dead and (label_id is None or self.label[row] == label_id)
+        ]
+
+    def lookup(self, text, label=None):
+        strings = self.strings
+        return [
+            (self.doc_ids[self.doc[row]], self.start[row], self.end[row], strings[self.surface[row]], strings[self.label[row]])
+            for row in self.__rows(text, label)
+        ]
+
+    def documents(self, text, label=None):
+        seen = {}
+        for row in self.__rows(text, label):
+            seen.setdefault(self.doc_ids[self.doc[row]], None)
+        return list(seen)
+
+    def frequency(self, text):
+        norm = normalize_entity(text)
+        return self.counts[self.strings[norm]] if norm in self.strings else 0
+
+    def labels(self, text):
+        norm = normalize_entity(text)
+        if norm not in self.strings:
+            return {}
+        facets = self.label_counts.get(self.strings[norm], {})
+        return {self.strings[label_id]: count for label_id, count in facets.items() if count > 0}
+
+    def variants(self, text):
+        return Counter(surface for _, _, _, surface, _ in self.lookup(text))
+
+    def top(self, n=10, label=None):
+        if label is None:
+            ranked = self.counts.most_common()
+        elif label not in self.strings:
+            return []
+        else:
+            label_id = self.strings[label]
+            ranked = sorted(
+                ((norm_id, facets[label_id]) for norm_id, facets in self.label_counts.items() if facets.get(label_id)),
+                key=lambda item: item[1], reverse=True,
+            )
+        return [(self.strings[norm_id], count) for norm_id, count in ranked if count > 0][:n]
+
+    def compact(self):
+        # Rewrite the arrays without postings from removed or re-indexed documents
+        live = [(self.doc_ids[number], number) for number in range(len(self.doc_ids)) if number not in self.__dead]
+        surface, label, start, end = self.surface, self.label, self.start, self.end
+        rows = {number: self.__doc_rows[number] for _, number in live}
+
+        self.__init__(self.strings)
+
+        for document_id, number in live:
+            first, last = rows[number]
+            self.add(document_id, (
+                (self.strings[surface[row]], start[row], end[row], self.strings[label[row]])
+                for row in range(first, last)
+            ))
@@ -0,0 +1,405 @@
+# Import native libraries
+import hashlib
+import json
+import logging
+import os
+import pickle
+import time
+from typing import Any, List, NamedTuple
+
+# Import third-party libraries
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+# Import project code
+from grimoire.core.entities import normalize_entity
+from grimoire.core.metadata import BOOL, DATETIME, FLOAT, INT, STR
+from grimoire.core.metrics import metrics
+from grimoire.nlp.features import Features
+from grimoire.nlp.lexemes import ALPHA, DIGIT, LOWER, NUMERIC, PUNCT, SPACE, STOP, TITLE, UPPER
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BLOCKS = ("flags", "tfidf", "entities", "embeddings", "metadata")
+
+FLAGS = {
+    "alpha": ALPHA, "digit": DIGIT, "lower": LOWER, "numeric": NUMERIC, "punct": PUNCT,
+    "space": SPACE, "stop": STOP, "title": TITLE, "upper": UPPER,
+}
+
+
+class FeatureMatrix(NamedTuple):
+    X: Any
+    y: Any
+    columns: List[str]
+    document_ids: List[Any]
+
+
+class FeatureMatrixBuilder:
+    # Every block works on whole chunks of documents at once: token columns are concatenated
+    # into one array per chunk and counted with numpy, never through per-token dicts
+    def __init__(self, blocks=("flags", "tfidf"), metadata=(), label=None, output="sparse", chunk_size=1000,
+                 min_df=1, max_df=1.0, max_features=None, max_entities=1000, dtype="float32"):
+        if np is None:
+            raise ImportError("Building feature matrices requires the numpy package: pip install numpy")
+        if output == "sparse" and sparse is None:
+            raise ImportError("Sparse feature matrices require the scipy package: pip install scipy")
+        if output not in ("sparse", "dense"):
+            raise ValueError(f"Unknown output type: {output}")
+
+        unknown = set(blocks) - set(BLOCKS)
+        if unknown:
+            raise ValueError(f"Unknown feature blocks: {', '.join(sorted(unknown))}")
+
+        self.blocks = tuple(blocks)
+        self.metadata = tuple(metadata)
+        self.label = label
+        self.output = output
+        self.chunk_size = chunk_size
+        self.min_df = min_df
+        self.max_df = max_df
+        self.max_features = max_features
+        self.max_entities = max_entities
+        self.dtype = dtype
+
+    def config(self):
+        return {
+            "blocks": self.blocks,
+            "metadata": self.metadata,
+            "label": self.label,
+            "output": self.output,
+            "min_df": self.min_df,
+            "max_df": self.max_df,
+            "max_features": self.max_features,
+            "max_entities": self.max_entities,
+            "dtype": self.dtype,
+        }
+
+    def cache_key(self, corpus):
+        # The corpus part of the key changes whenever a document is added, removed or re-fetched, or its
+        # features are extracted again. Revisions only count within one corpus store, so its ID is included.
+        model = Features.nlp.meta
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.config(), sort_keys=True, default=str).encode("utf-8"))
+        digest.update(repr((str(corpus.id), model.get("name"), model.get("version"))).encode("utf-8"))
+
+        for doc in corpus.documents:
+            revision = corpus.store.features_revision(doc.id)
+            digest.update(repr((doc.id, corpus.versions.get(doc.id), revision)).encode("utf-8"))
+
+        return digest.hexdigest()
+
+    def build(self, corpus, cache_dir=None):
+        path = None
+
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, f"{self.cache_key(corpus)}.pkl")
+
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    logger.info(f"Loaded feature matrix from cache: {path}")
+                    return pickle.load(f)
+
+        start = time.perf_counter()
+        documents = corpus.documents
+        n = len(documents)
+
+        # Vocabularies need one pass over the whole corpus before any row can be written
+        blocks = []
+        for name in self.blocks:
+            if name == "flags":
+                blocks.append(_FlagBlock())
+            elif name == "tfidf":
+                blocks.append(_TfidfBlock(corpus, self))
+            elif name == "entities":
+                blocks.append(_EntityBlock(corpus, self.max_entities))
+            elif name == "embeddings":
+                blocks.append(_EmbeddingBlock(corpus))
+            elif name == "metadata":
+                blocks.append(_MetadataBlock(corpus, self.metadata))
+
+        columns = [column for block in blocks for column in block.columns]
+        chunks = []
+        X = np.zeros((n, len(columns)), dtype=self.dtype) if self.output == "dense" else None
+
+        for first in range(0, n, self.chunk_size):
+            rows = range(first, min(n, first + self.chunk_size))
+            chunk = _Chunk(corpus, rows)
+            parts = [block.transform(chunk) for block in blocks]
+
+            if self.output == "dense":
+                offset = 0
+                for part in parts:
+                    width = part.shape[1]
+                    X[rows.start:rows.stop, offset:offset + width] = part.toarray() if sparse is not None and sparse.issparse(part) else part
+                    offset += width
+            else:
+                # Dense blocks are converted first, hstack cannot mix them with sparse ones
+                chunks.append(sparse.hstack([sparse.csr_matrix(part) for part in parts], format="csr", dtype=self.dtype))
+
+        if self.output == "sparse":
+            X = sparse.vstack(chunks, format="csr", dtype=self.dtype) if chunks else sparse.csr_matrix((0, len(columns)), dtype=self.dtype)
+
+        y = None
+        if self.label is not None:
+            y = np.array([corpus.metadata.get(row, self.label) for row in range(n)])
+
+        matrix = FeatureMatrix(X, y, columns, [doc.id for doc in documents])
+
+        elapsed = time.perf_counter() - start
+        metrics.observe("feature_matrix_seconds", elapsed)
+        logger.info(f"Built a {n} x {len(columns)} {self.output} feature matrix in {elapsed:.2f}s")
+
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(matrix, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+
+        return matrix
+
+
+class _Chunk:
+    # The token columns of a run of documents, concatenated, plus the document each token belongs to
+    def __init__(self, corpus, rows):
+        self.corpus = corpus
+        self.rows = rows
+        self.features = [corpus.documents[row].features for row in rows]
+
+        lengths = np.fromiter((len(features.orth) for features in self.features), dtype=np.int64, count=len(rows))
+        self.lengths = lengths
+        self.orth = np.concatenate([_as_numpy(features.orth) for features in self.features]).astype(np.int64) if len(rows) else np.zeros(0, dtype=np.int64)
+        self.doc = np.repeat(np.arange(len(rows)), lengths)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _as_numpy(values):
+    # Zero-copy view of an array.array column
+    return np.frombuffer(values, dtype=np.dtype(values.typecode)) if len(values) else np.zeros(0, dtype=np.dtype(values.typecode))
+
+
+class _FlagBlock:
+    columns = ["tokens"] + [f"flag:{name}" for name in FLAGS]
+
+    def transform(self, chunk):
+        flags = _as_numpy(chunk.corpus.vocab.lexemes.flags)[chunk.orth]
+        lengths = chunk.lengths
+        out = np.zeros((len(chunk), len(self.columns)))
+        out[:, 0] = lengths
+
+        # Share of each document's tokens that carry the flag
+        for j, flag in enumerate(FLAGS.values(), 1):
+            counts = np.bincount(chunk.doc, weights=(flags & flag) != 0, minlength=len(chunk))
+            out[:, j] = np.divide(counts, lengths, out=np.zeros(len(chunk)), where=lengths > 0)
+
+        return out
+
+
+class _TfidfBlock:
+    def __init__(self, corpus, builder):
+        lexemes = corpus.vocab.lexemes
+        flags = _as_numpy(lexemes.flags)
+
+        # Case-folded terms without punctuation or whitespace: lexeme id -> term id, -1 to drop
+        term_ids = {}
+        term_of = np.full(len(lexemes), -1, dtype=np.int64)
+        keep = (flags & (PUNCT | SPACE)) == 0
+
+        for lex_id, form in enumerate(lexemes.forms):
+            if keep[lex_id]:
+                term_of[lex_id] = term_ids.setdefault(form.lower(), len(term_ids))
+
+        terms = list(term_ids)
+        n = len(corpus.documents)
+        df = np.zeros(len(terms), dtype=np.int64)
+
+        for first in range(0, n, builder.chunk_size):
+            chunk = _Chunk(corpus, range(first, min(n, first + builder.chunk_size)))
+            doc, term = self.__pairs(chunk, term_of)
+            pairs = np.unique(doc * len(terms) + term)
+            df += np.bincount(pairs % len(terms), minlength=len(terms)) if len(terms) else 0
+
+        max_df = builder.max_df if isinstance(builder.max_df, int) else builder.max_df * n
+        selected = np.flatnonzero((df >= builder.min_df) & (df <= max_df))
+
+        if builder.max_features is not None and len(selected) > builder.max_features:
+            # Highest document frequency first, ties broken by term id so the choice is stable
+            order = np.lexsort((selected, -df[selected]))
+            selected = np.sort(selected[order[:builder.max_features]])
+
+        column_of = np.full(len(terms), -1, dtype=np.int64)
+        column_of[selected] = np.arange(len(selected))
+
+        self.term_of = term_of
+        self.column_of = column_of
+        self.idf = np.log((1 + n) / (1 + df[selected])) + 1
+        self.columns = [f"tfidf:{terms[i]}" for i in selected]
+
+    @staticmethod
+    def __pairs(chunk, term_of):
+        orth = chunk.orth
+        # Lexemes added after the block was built have no term
+        valid = orth < len(term_of)
+        term = np.full(len(orth), -1, dtype=np.int64)
+        term[valid] = term_of[orth[valid]]
+        mask = term >= 0
+        return chunk.doc[mask], term[mask]
+
+    def transform(self, chunk):
+        doc, term = self.__pairs(chunk, self.term_of)
+        column = self.column_of[term]
+        mask = column >= 0
+        doc, column = doc[mask], column[mask]
+
+        width = len(self.columns)
+        keys, counts = np.unique(doc * width + column, return_counts=True)
+        rows, cols = keys // width, keys % width
+        values = counts * self.idf[cols]
+
+        # l2 normalise each row
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(chunk)))
+        values = values / norms[rows]
+
+        if sparse is None:
+            out = np.zeros((len(chunk), width))
+            out[rows, cols] = values
+            return out
+        return sparse.csr_matrix((values, (rows, cols)), shape=(len(chunk), width))
+
+
+class _EntityBlock:
+    def __init__(self, corpus, max_entities):
+        top = corpus.entities.top(max_entities)
+        self.column_of = {entity: j for j, (entity, _) in enumerate(top)}
+        self.columns = [f"entity:{entity}" for entity, _ in top]
+
+    def transform(self, chunk):
+        rows, cols = [], []
+
+        for i, features in enumerate(chunk.features):
+            for text, _, _, _ in features.entities:
+                j = self.column_of.get(normalize_entity(text))
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+
+        shape = (len(chunk), len(self.columns))
+        values = np.ones(len(rows))
+
+        if sparse is None:
+            out = np.zeros(shape)
+            np.add.at(out, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), values)
+            return out
+        # Duplicate (row, column) pairs are summed into counts
+        return sparse.csr_matrix((values, (rows, cols)), shape=shape)
+
+
+class _EmbeddingBlock:
+    # Pairs are summed this many at a time when scipy is missing, to bound the temporary vectors
+    SLICE = 4096
+
+    def __init__(self, corpus):
+        # Only lexemes with a vector get a row in the table; a document is the mean of its token
+        # vectors, with tokens that have no vector counting as zeros
+        vocab = Features.nlp.vocab
+        width = vocab.vectors_length
+
+        if not width:
+            raise ValueError("The loaded spaCy model has no word vectors to build embeddings from")
+
+        forms = corpus.vocab.lexemes.forms
+        self.row_of = np.full(len(forms), -1, dtype=np.int64)
+        vectors = []
+
+        for lex_id, form in enumerate(forms):
+            lexeme = vocab[form]
+            if lexeme.has_vector:
+                self.row_of[lex_id] = len(vectors)
+                vectors.append(lexeme.vector)
+
+        self.table = np.array(vectors, dtype=np.float32).reshape(len(vectors), width)
+        self.columns = [f"embedding:{j}" for j in range(width)]
+
+    def transform(self, chunk):
+        orth = chunk.orth
+        # Lexemes added after the block was built have no vector
+        row = np.full(len(orth), -1, dtype=np.int64)
+        valid = orth < len(self.row_of)
+        row[valid] = self.row_of[orth[valid]]
+        mask = row >= 0
+        doc, row = chunk.doc[mask], row[mask]
+
+        # A document x lexeme count matrix times the vector table sums each document's token vectors
+        # without ever holding one vector per token
+        shape = (len(chunk), len(self.table))
+
+        if sparse is not None:
+            counts = sparse.csr_matrix((np.ones(len(doc), dtype=np.float32), (doc, row)), shape=shape)
+            out = np.asarray(counts @ self.table, dtype=np.float32)
+        else:
+            keys, counts = np.unique(doc * shape[1] + row, return_counts=True)
+            out = np.zeros((len(chunk), self.table.shape[1]), dtype=np.float32)
+
+            for first in range(0, len(keys), self.SLICE):
+                part = keys[first:first + self.SLICE]
+                np.add.at(out, part // shape[1], self.table[part % shape[1]] * counts[first:first + self.SLICE, None])
+
+        nonempty = chunk.lengths > 0
+        out[nonempty] /= chunk.lengths[nonempty, None]
+        return out
+
+
+class _MetadataBlock:
+    # Numeric, boolean and datetime columns are used as they are, string columns are one-hot encoded
+    def __init__(self, corpus, fields):
+        self.metadata = corpus.metadata
+        self.fields = []
+        self.columns = []
+
+        for name in fields:
+            column = self.metadata.columns.get(name)
+
+            if column is None:
+                raise KeyError(f"No metadata field named {name}")
+
+            if column.dtype in (INT, FLOAT, BOOL, DATETIME):
+                self.fields.append((column, None))
+                self.columns.append(f"metadata:{name}")
+            elif column.dtype == STR:
+                values = np.unique(_as_numpy(column.data))
+                values = values[values >= 0]
+                self.fields.append((column, values))
+                self.columns.extend(f"metadata:{name}={column.strings[int(value)]}" for value in values)
+            else:
+                raise ValueError(f"Metadata field {name} holds {column.dtype} values, which cannot be used as features")
+
+    def transform(self, chunk):
+        rows = chunk.rows
+        parts = []
+
+        for column, values in self.fields:
+            data = _as_numpy(column.data)[rows.start:rows.stop]
+
+            if values is None:
+                part = data.astype(np.float64)
+                # Ints and bools mark missing values outside the array
+                if column.dtype == INT:
+                    part[[row - rows.start for row in column.missing if rows.start <= row < rows.stop]] = np.nan
+                elif column.dtype == BOOL:
+                    part[data == -1] = np.nan
+                parts.append(part[:, None])
+            else:
+                parts.append((data[:, None] == values[None, :]).astype(np.float64))
+
+        return np.hstack(parts) if parts else np.zeros((len(chunk), 0))
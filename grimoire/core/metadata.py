@@ -0,0 +1,535 @@
+# Import native libraries
+import bisect
+import hashlib
+import json
+import logging
+import math
+import re
+from array import array
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INT = "int"
+FLOAT = "float"
+BOOL = "bool"
+DATETIME = "datetime"
+STR = "str"
+OBJECT = "object"
+
+# INT columns are array("q"), so ints outside int64 (uint64 checksums, say) are stored as objects
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+
+OPERATORS = ("eq", "ne", "gt", "gte", "lt", "lte", "in", "contains", "isnull")
+
+# Checked in order - the first one present in a document's metadata is its version
+VERSION_FIELDS = (
+    "etag", "ETag", "checksum", "md5", "sha256", "version", "versionId",
+    "modified", "modifiedDate", "lastModified", "last_modified", "updated", "updatedAt",
+)
+
+_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    elif isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    elif isinstance(value, str) and _DATE_PATTERN.match(value):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    return None
+
+
+def document_version(attributes) -> str:
+    attributes = attributes or {}
+
+    for field in VERSION_FIELDS:
+        if attributes.get(field) is not None:
+            return f"{field}:{attributes[field]}"
+
+    # No version field, so any change to the metadata counts as a new version
+    payload = json.dumps(attributes, sort_keys=True, default=str).encode("utf-8")
+    return f"hash:{hashlib.sha1(payload).hexdigest()}"
+
+
+def infer_dtype(value) -> str:
+    if isinstance(value, bool):
+        return BOOL
+    elif isinstance(value, int):
+        return INT if INT_MIN <= value <= INT_MAX else OBJECT
+    elif isinstance(value, float):
+        return FLOAT
+    elif isinstance(value, (datetime, date)) or parse_datetime(value) is not None:
+        return DATETIME
+    elif isinstance(value, str):
+        return STR
+    return OBJECT
+
+
+class Column:
+    # Missing values: NaN for float/datetime, -1 for str ids and bools, a row set for ints
+    def __init__(self, name, dtype, strings):
+        self.name = name
+        self.dtype = dtype
+        self.strings = strings
+        self.missing = set()
+
+        if dtype == INT:
+            self.data = array("q")
+        elif dtype in (FLOAT, DATETIME):
+            self.data = array("d")
+        elif dtype == BOOL:
+            self.data = array("b")
+        elif dtype == STR:
+            self.data = array("l")
+        else:
+            self.data = []
+
+    def __len__(self):
+        return len(self.data)
+
+    def accepts(self, value) -> bool:
+        if value is None or self.dtype == OBJECT:
+            return True
+        elif self.dtype == FLOAT:
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+        elif self.dtype == DATETIME:
+            return parse_datetime(value) is not None
+        return infer_dtype(value) == self.dtype
+
+    def encode(self, value):
+        if self.dtype == INT:
+            return int(value)
+        elif self.dtype == FLOAT:
+            return float(value)
+        elif self.dtype == DATETIME:
+            return parse_datetime(value).timestamp()
+        elif self.dtype == BOOL:
+            return int(value)
+        elif self.dtype == STR:
+            return self.strings.add(value)
+        return value
+
+    def append(self, value):
+        self.append_key(None if value is None else self.encode(value))
+
+    def append_key(self, key):
+        if key is None:
+            self.append_missing()
+        else:
+            self.data.append(key)
+
+    def set(self, row, value):
+        self.set_key(row, None if value is None else self.encode(value))
+
+    def set_key(self, row, key):
+        self.missing.discard(row)
+
+        if key is not None:
+            self.data[row] = key
+        elif self.dtype in (FLOAT, DATETIME):
+            self.data[row] = math.nan
+        elif self.dtype in (BOOL, STR):
+            self.data[row] = -1
+        elif self.dtype == INT:
+            self.missing.add(row)
+            self.data[row] = 0
+        else:
+            self.data[row] = None
+
+    def append_missing(self):
+        if self.dtype in (FLOAT, DATETIME):
+            self.data.append(math.nan)
+        elif self.dtype in (BOOL, STR):
+            self.data.append(-1)
+        elif self.dtype == INT:
+            self.missing.add(len(self.data))
+            self.data.append(0)
+        else:
+            self.data.append(None)
+
+    def is_missing(self, row) -> bool:
+        value = self.data[row]
+
+        if self.dtype in (FLOAT, DATETIME):
+            return math.isnan(value)
+        elif self.dtype in (BOOL, STR):
+            return value == -1
+        elif self.dtype == INT:
+            return row in self.missing
+        return value is None
+
+    def get(self, row):
+        if self.is_missing(row):
+            return None
+
+        value = self.data[row]
+
+        if self.dtype == DATETIME:
+            return datetime.fromtimestamp(value)
+        elif self.dtype == BOOL:
+            return bool(value)
+        elif self.dtype == STR:
+            return self.strings[value]
+        return value
+
+    def values(self) -> List[Any]:
+        return [self.get(row) for row in range(len(self.data))]
+
+
+class HashIndex:
+    # Postings are sets so update can move a row in O(1), even under a value most rows share
+    def __init__(self, column):
+        self.column = column
+        self.postings = {}
+
+        for row in range(len(column)):
+            self.add(row)
+
+    def add(self, row):
+        if not self.column.is_missing(row):
+            self.postings.setdefault(self.column.data[row], set()).add(row)
+
+    def remove(self, row):
+        if not self.column.is_missing(row):
+            postings = self.postings.get(self.column.data[row])
+            if postings is not None:
+                postings.discard(row)
+                if not postings:
+                    del self.postings[self.column.data[row]]
+
+    def lookup(self, key) -> Iterable[int]:
+        return self.postings.get(key, ())
+
+
+class SortedIndex:
+    # Appends only mark the index stale, it is re-sorted on the next range query
+    def __init__(self, column):
+        self.column = column
+        self.keys = []
+        self.rows = array("L")
+        self.__stale = True
+
+    def add(self, row):
+        self.__stale = True
+
+    def remove(self, row):
+        self.__stale = True
+
+    def __refresh(self):
+        data = self.column.data
+        rows = sorted((row for row in range(len(data)) if not self.column.is_missing(row)), key=data.__getitem__)
+        self.keys = [data[row] for row in rows]
+        self.rows = array("L", rows)
+        self.__stale = False
+
+    def range(self, low=None, high=None, include_low=True, include_high=True) -> Iterable[int]:
+        if self.__stale:
+            self.__refresh()
+
+        if low is None:
+            start = 0
+        elif include_low:
+            start = bisect.bisect_left(self.keys, low)
+        else:
+            start = bisect.bisect_right(self.keys, low)
+
+        if high is None:
+            end = len(self.keys)
+        elif include_high:
+            end = bisect.bisect_right(self.keys, high)
+        else:
+            end = bisect.bisect_left(self.keys, high)
+
+        return self.rows[start:end]
+
+
+class MetadataStore:
+    def __init__(self, strings):
+        self.strings = strings
+        self.columns = {}
+        self.indexes = {}
+        self.num_rows = 0
+
+    def __len__(self):
+        return self.num_rows
+
+    def append(self, attributes: Dict[str, Any]):
+        attributes = attributes or {}
+        columns = {}
+
+        # Every column is added or widened before any value is appended, so they all stay num_rows long
+        # until the row is written
+        for name, value in attributes.items():
+            column = self.columns.get(name)
+
+            # Columns are typed by their first non-null value
+            if column is None and value is None:
+                continue
+            elif column is None:
+                column = self.__add_column(name, infer_dtype(value))
+            elif not column.accepts(value):
+                column = self.__widen_column(column, value)
+
+            columns[name] = column
+
+        # Encoded up front, so a value that cannot be stored fails before any column has grown
+        keys = self.__encode(columns, attributes)
+
+        for name, column in columns.items():
+            column.append_key(keys[name])
+
+        for name, column in self.columns.items():
+            if len(column) == self.num_rows:
+                column.append_missing()
+
+        for indexes in self.indexes.values():
+            for index in indexes.values():
+                index.add(self.num_rows)
+
+        self.num_rows += 1
+
+    def append_many(self, attributes_list: Iterable[Dict[str, Any]]):
+        for attributes in attributes_list:
+            self.append(attributes)
+
+    def update(self, row, attributes: Dict[str, Any]):
+        attributes = attributes or {}
+        columns = {}
+
+        # Widening rebuilds a column's indexes from its current values, so it happens before the row is
+        # taken out of them
+        for name, value in attributes.items():
+            column = self.columns.get(name)
+
+            if column is None and value is None:
+                continue
+            elif column is None:
+                column = self.__add_column(name, infer_dtype(value))
+            elif not column.accepts(value):
+                column = self.__widen_column(column, value)
+
+            columns[name] = column
+
+        keys = self.__encode(columns, attributes)
+
+        for indexes in self.indexes.values():
+            for index in indexes.values():
+                index.remove(row)
+
+        for name, column in self.columns.items():
+            column.set_key(row, keys.get(name))
+
+        for indexes in self.indexes.values():
+            for index in indexes.values():
+                index.add(row)
+
+    @staticmethod
+    def __encode(columns, attributes):
+        return {
+            name: None if attributes[name] is None else column.encode(attributes[name])
+            for name, column in columns.items()
+        }
+
+    def __add_column(self, name, dtype):
+        column = Column(name, dtype, self.strings)
+
+        for _ in range(self.num_rows):
+            column.append_missing()
+
+        self.columns[name] = column
+        return column
+
+    def __widen_column(self, column, value):
+        values = column.values()
+        dtype = FLOAT if column.dtype == INT and infer_dtype(value) == FLOAT else OBJECT
+        widened = Column(column.name, dtype, self.strings)
+
+        for existing in values:
+            widened.append(existing)
+
+        self.columns[column.name] = widened
+
+        if dtype == OBJECT and column.name in self.indexes:
+            # Queries on object columns always scan, and their values may not hash or sort
+            logger.warning(f"Dropped the indexes on {column.name}, it now holds mixed or structured values")
+            del self.indexes[column.name]
+
+        for kind in list(self.indexes.get(column.name, {})):
+            self.create_index(column.name, kind)
+
+        return widened
+
+    def create_index(self, name, kind="hash"):
+        column = self.columns[name]
+
+        if column.dtype == OBJECT:
+            raise ValueError(f"Cannot index {name}, it holds mixed or structured values")
+
+        if kind == "hash":
+            index = HashIndex(column)
+        elif kind == "sorted":
+            index = SortedIndex(column)
+        else:
+            raise ValueError(f"Unknown index kind: {kind}")
+
+        self.indexes.setdefault(name, {})[kind] = index
+
+    def take(self, rows: Iterable[int]) -> "MetadataStore":
+        rows = list(rows)
+        store = MetadataStore(self.strings)
+
+        for name, column in self.columns.items():
+            taken = Column(name, column.dtype, self.strings)
+
+            for row in rows:
+                taken.append(column.get(row))
+
+            store.columns[name] = taken
+
+        store.num_rows = len(rows)
+
+        for name, indexes in self.indexes.items():
+            for kind in indexes:
+                store.create_index(name, kind)
+
+        return store
+
+    def get(self, row, name):
+        column = self.columns.get(name)
+        return column.get(row) if column is not None else None
+
+    def query(self, rows=None, **conditions) -> List[int]:
+        candidates = None if rows is None else set(rows)
+
+        for key, target in conditions.items():
+            name, operator = key, "eq"
+
+            if "__" in key:
+                field, suffix = key.rsplit("__", 1)
+                if suffix in OPERATORS:
+                    name, operator = field, suffix
+
+            matched = self.__match(name, operator, target)
+            candidates = matched if candidates is None else candidates & matched
+
+            if not candidates:
+                break
+
+        if candidates is None:
+            candidates = range(self.num_rows)
+
+        return sorted(candidates)
+
+    def __match(self, name, operator, target) -> set:
+        column = self.columns.get(name)
+
+        if column is None:
+            return set(range(self.num_rows)) if operator == "isnull" and target else set()
+
+        if operator == "isnull":
+            return {row for row in range(self.num_rows) if column.is_missing(row) == bool(target)}
+
+        if operator == "in":
+            matched = set()
+            for item in target:
+                matched |= self.__match(name, "eq", item)
+            return matched
+
+        if operator == "contains" or column.dtype == OBJECT:
+            return self.__scan(column, operator, target)
+
+        if column.dtype == STR and operator not in ("eq", "ne"):
+            return self.__scan(column, operator, target)
+
+        key = self.__encode_target(column, target)
+
+        if key is None:
+            return set(range(self.num_rows)) if operator == "ne" else set()
+
+        indexes = self.indexes.get(name, {})
+
+        if operator == "eq" and "hash" in indexes:
+            return set(indexes["hash"].lookup(key))
+
+        if "sorted" in indexes and operator in ("eq", "gt", "gte", "lt", "lte"):
+            index = indexes["sorted"]
+            if operator == "eq":
+                return set(index.range(key, key))
+            elif operator in ("gt", "gte"):
+                return set(index.range(low=key, include_low=operator == "gte"))
+            else:
+                return set(index.range(high=key, include_high=operator == "lte"))
+
+        data = column.data
+        compare = _COMPARATORS[operator]
+        return {row for row in range(len(data)) if not column.is_missing(row) and compare(data[row], key)}
+
+    def __encode_target(self, column, target):
+        if column.dtype == STR:
+            return self.strings[target] if target in self.strings else None
+        elif column.dtype == DATETIME:
+            parsed = parse_datetime(target)
+            return parsed.timestamp() if parsed is not None else None
+        elif column.dtype == BOOL:
+            return int(target)
+        return target
+
+    def __scan(self, column, operator, target) -> set:
+        compare = _COMPARATORS[operator]
+        matched = set()
+
+        for row in range(self.num_rows):
+            value = column.get(row)
+            try:
+                if value is not None and compare(value, target):
+                    matched.add(row)
+            except TypeError:
+                continue
+
+        return matched
+
+
+_COMPARATORS = {
+    "eq": lambda value, target: value == target,
+    "ne": lambda value, target: value != target,
+    "gt": lambda value, target: value > target,
+    "gte": lambda value, target: value >= target,
+    "lt": lambda value, target: value < target,
+    "lte": lambda value, target: value <= target,
+    "contains": lambda value, target: target in value,
+}
+
+
+class CorpusView:
+    def __init__(self, corpus, rows):
+        self.corpus = corpus
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        documents = self.corpus.documents
+        return (documents[row] for row in self.rows)
+
+    def __getitem__(self, i):
+        return self.corpus.documents[self.rows[i]]
+
+    @property
+    def documents(self):
+        return list(self)
+
+    @property
+    def ids(self):
+        return [doc.id for doc in self]
+
+    def filter(self, **conditions) -> "CorpusView":
+        return CorpusView(self.corpus, self.corpus.metadata.query(self.rows, **conditions))
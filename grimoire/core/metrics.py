@@ -0,0 +1,287 @@
+# Import native libraries
+import bisect
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class Metrics:
+    # Every recording call returns straight away while disabled, so the hot paths pay one attribute check
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+        self.__lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.__lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items()))) if labels else (name, ())
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.__lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def set_max(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.__lock:
+            self.gauges[key] = max(self.gauges.get(key, value), value)
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self.__lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def record_memory(self):
+        if not self.enabled:
+            return
+        # ru_maxrss is kilobytes on Linux
+        self.set_max("memory_high_water_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+    def snapshot(self):
+        with self.__lock:
+            return {
+                "counters": [(name, dict(labels), value) for (name, labels), value in self.counters.items()],
+                "gauges": [(name, dict(labels), value) for (name, labels), value in self.gauges.items()],
+                "histograms": [(name, dict(labels), histogram.snapshot()) for (name, labels), histogram in self.histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        # Folds in a snapshot taken in another process: counters and histograms add up, gauges take its value
+        if not self.enabled:
+            return
+        with self.__lock:
+            for name, labels, value in snapshot["counters"]:
+                key = self._key(name, labels)
+                self.counters[key] = self.counters.get(key, 0) + value
+
+            for name, labels, value in snapshot["gauges"]:
+                self.gauges[self._key(name, labels)] = value
+
+            for name, labels, data in snapshot["histograms"]:
+                key = self._key(name, labels)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(tuple(bound for bound, _ in data["buckets"][:-1]))
+
+                previous = 0
+                for i, (_, total) in enumerate(data["buckets"]):
+                    histogram.counts[i] += total - previous
+                    previous = total
+                histogram.sum += data["sum"]
+                histogram.count += data["count"]
+
+    def export(self, exporter):
+        return exporter.export(self.snapshot())
+
+
+class InMemoryExporter:
+    def __init__(self):
+        self.snapshots = []
+
+    def export(self, snapshot):
+        self.snapshots.append(snapshot)
+        return snapshot
+
+
+class JSONExporter:
+    def __init__(self, path=None):
+        self.path = path
+
+    def export(self, snapshot):
+        payload = {
+            "timestamp": time.time(),
+            "counters": [{"name": name, "labels": labels, "value": value} for name, labels, value in snapshot["counters"]],
+            "gauges": [{"name": name, "labels": labels, "value": value} for name, labels, value in snapshot["gauges"]],
+            "histograms": [
+                {"name": name, "labels": labels, "sum": data["sum"], "count": data["count"],
+                 "buckets": [[str(bound), count] for bound, count in data["buckets"]]}
+                for name, labels, data in snapshot["histograms"]
+            ],
+        }
+        text = json.dumps(payload, indent=2)
+
+        if self.path:
+            with open(self.path, "w") as f:
+                f.write(text)
+
+        return text
+
+
+class PrometheusExporter:
+    def __init__(self, path=None, prefix="grimoire_"):
+        self.path = path
+        self.prefix = prefix
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def _labels(self, labels, extra=None):
+        labels = dict(labels, **(extra or {}))
+        if not labels:
+            return ""
+        body = ",".join(f'{key}="{self._escape(value)}"' for key, value in sorted(labels.items()))
+        return "{" + body + "}"
+
+    def export(self, snapshot):
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+
+        for name, labels, value in snapshot["counters"]:
+            declare(self.prefix + name, "counter")
+            lines.append(f"{self.prefix}{name}{self._labels(labels)} {value}")
+
+        for name, labels, value in snapshot["gauges"]:
+            declare(self.prefix + name, "gauge")
+            lines.append(f"{self.prefix}{name}{self._labels(labels)} {value}")
+
+        for name, labels, data in snapshot["histograms"]:
+            metric = self.prefix + name
+            declare(metric, "histogram")
+            for bound, count in data["buckets"]:
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{self._labels(labels, {'le': le})} {count}")
+            lines.append(f"{metric}_sum{self._labels(labels)} {data['sum']}")
+            lines.append(f"{metric}_count{self._labels(labels)} {data['count']}")
+
+        text = "\n".join(lines) + "\n"
+
+        if self.path:
+            with open(self.path, "w") as f:
+                f.write(text)
+
+        return text
+
+
+@contextlib.contextmanager
+def profile(path=None, sort="cumulative", limit=30):
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+
+        if path:
+            profiler.dump_stats(path)
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+            logger.info(f"Profile results:\n{stream.getvalue()}")
+
+
+@contextlib.contextmanager
+def trace_memory(name="tracemalloc_peak_bytes"):
+    already_tracing = tracemalloc.is_tracing()
+
+    if not already_tracing:
+        tracemalloc.start()
+
+    tracemalloc.reset_peak()
+
+    try:
+        yield
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        metrics.set_max(name, peak)
+
+        if not already_tracing:
+            tracemalloc.stop()
+
+
+metrics = Metrics(enabled=os.environ.get("GRIMOIRE_METRICS", "").lower() in ("1", "true", "yes"))
@@ -0,0 +1,247 @@
+# Import native libraries
+import atexit
+import json
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+
+# Import project code
+from grimoire.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MANIFEST = "manifest.json"
+
+_STOP = object()
+
+
+def write_atomic(path, data):
+    # Readers only ever see the old file or the complete new one
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(temp_path, path)
+
+
+class SegmentLog:
+    # A directory holding one full corpus snapshot (the base) plus append-only segments with the
+    # documents added, changed or removed since. The manifest lists which files are live and is
+    # replaced atomically after each write, so a crash leaves the previous consistent state.
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.manifest = self.read_manifest()
+        # Document ID -> signature of what is on disk, known once this process has loaded or saved.
+        # pending is what will be on disk once the queued writes finish; new segments diff against it.
+        self.persisted = None
+        self.pending = None
+        self.corpus_id = None
+
+        self.__queue = queue.Queue()
+        self.__error = None
+        self.__lock = threading.Lock()
+        self.__thread = None
+        # Bumped on every failed write, so jobs queued before the failure are dropped
+        self.__generation = 0
+
+    def read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+
+        if not os.path.exists(path):
+            return {"corpus": None, "base": None, "segments": [], "next": 0}
+
+        with open(path) as f:
+            return json.load(f)
+
+    def __write_manifest(self, manifest):
+        write_atomic(os.path.join(self.directory, MANIFEST), json.dumps(manifest, indent=2).encode("utf-8"))
+        self.manifest = manifest
+
+    def __next_name(self, manifest, kind):
+        name = f"{kind}-{manifest['next']:06d}.pkl"
+        manifest["next"] += 1
+        return name
+
+    def read(self):
+        # The base corpus and the segment payloads, in the order they were written
+        manifest = self.read_manifest()
+
+        if manifest["base"] is None:
+            raise FileNotFoundError(f"No saved corpus in {self.directory}")
+
+        with open(os.path.join(self.directory, manifest["base"]), "rb") as f:
+            corpus = pickle.load(f)
+
+        segments = []
+        for name in manifest["segments"]:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                segments.append(pickle.load(f))
+
+        return corpus, segments
+
+    # Work runs on one background thread in submission order, so segments are never reordered
+    def __start(self):
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__thread = threading.Thread(target=self.__run, name=f"SegmentLog-{self.directory}", daemon=True)
+                self.__thread.start()
+
+    def __run(self):
+        while True:
+            job = self.__queue.get()
+
+            try:
+                if job is _STOP:
+                    return
+                job()
+            except Exception as e:
+                logger.error(f"Failed to write to {self.directory}: {e}")
+                self.__fail(e)
+            finally:
+                self.__queue.task_done()
+
+    def __fail(self, error):
+        # Segments queued behind the failed one only hold the changes made after it, so they
+        # are dropped, and the next save writes a full base since what is on disk is unknown
+        with self.__lock:
+            self.__error = error
+            self.__generation += 1
+            self.persisted = None
+            self.pending = None
+
+    def __current(self, generation):
+        with self.__lock:
+            return generation == self.__generation
+
+    def submit(self, job, wait=False):
+        self.__start()
+        self.__queue.put(job)
+        if wait:
+            self.flush()
+
+    def flush(self):
+        self.__queue.join()
+
+        if self.__error is not None:
+            error, self.__error = self.__error, None
+            raise error
+
+    def close(self):
+        if self.__thread is not None and self.__thread.is_alive():
+            self.__queue.put(_STOP)
+            self.__thread.join()
+        self.flush()
+
+    def write_base(self, corpus_id, data, persisted):
+        # Everything in the old base and segments is in the new base, so they can go
+        def job():
+            if not self.__current(generation):
+                logger.warning(f"Dropped a queued corpus base for {self.directory} after an earlier write failed")
+                return
+
+            start = time.perf_counter()
+            manifest = dict(self.manifest)
+            name = self.__next_name(manifest, "base")
+            write_atomic(os.path.join(self.directory, name), data)
+
+            stale = ([self.manifest["base"]] if self.manifest["base"] else []) + self.manifest["segments"]
+            manifest.update(corpus=str(corpus_id), base=name, segments=[])
+            self.__write_manifest(manifest)
+
+            with self.__lock:
+                if generation == self.__generation:
+                    self.persisted = persisted
+
+            for old in stale:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except FileNotFoundError:
+                    pass
+
+            metrics.inc("persistence_bytes_total", len(data), kind="base")
+            metrics.observe("persistence_seconds", time.perf_counter() - start, kind="base")
+            logger.info(f"Wrote corpus base {name} ({len(data)} bytes)")
+
+        with self.__lock:
+            generation = self.__generation
+            self.corpus_id = str(corpus_id)
+            self.pending = persisted
+
+        return job
+
+    def write_segment(self, build, since, persisted):
+        # build runs on the writer thread and returns the segment payload. since is the pending
+        # state the segment was diffed against; if a write failed meanwhile there is no job.
+        def job():
+            if not self.__current(generation):
+                logger.warning(f"Dropped a queued corpus segment for {self.directory} after an earlier write failed")
+                return
+
+            start = time.perf_counter()
+            data = pickle.dumps(build(), protocol=pickle.HIGHEST_PROTOCOL)
+            manifest = dict(self.manifest)
+            name = self.__next_name(manifest, "segment")
+            write_atomic(os.path.join(self.directory, name), data)
+
+            manifest["segments"] = self.manifest["segments"] + [name]
+            self.__write_manifest(manifest)
+
+            with self.__lock:
+                if generation == self.__generation:
+                    self.persisted = persisted
+
+            metrics.inc("persistence_bytes_total", len(data), kind="segment")
+            metrics.observe("persistence_seconds", time.perf_counter() - start, kind="segment")
+            logger.info(f"Appended corpus segment {name} ({len(data)} bytes)")
+
+        with self.__lock:
+            if since is None or since is not self.pending:
+                return None
+            generation = self.__generation
+            self.pending = persisted
+
+        return job
+
+    def restore(self, corpus_id, persisted):
+        # After a load, what is on disk is exactly the loaded corpus
+        with self.__lock:
+            self.corpus_id = str(corpus_id)
+            self.persisted = persisted
+            self.pending = persisted
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def open_log(directory):
+    # One log per directory in a process, so every save to it goes through the same writer thread
+    key = os.path.abspath(directory)
+
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = SegmentLog(directory)
+        return log
+
+
+@atexit.register
+def close_logs():
+    # The writer threads are daemons, so queued saves are finished here rather than lost at exit
+    with _logs_lock:
+        logs = list(_logs.values())
+
+    for log in logs:
+        try:
+            log.close()
+        except Exception as e:
+            logger.error(f"Corpus writes to {log.directory} did not finish: {e}")
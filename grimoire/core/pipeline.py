@@ -0,0 +1,297 @@
+# Import native libraries
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import pickle
+import queue
+import threading
+
+# Import project code
+from grimoire.core.metrics import metrics
+from grimoire.core.vocab import Vocab
+from grimoire.nlp.features import Features
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_DONE = object()
+_MISS = object()
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+class Stage:
+    # executor is "thread" for I/O bound work or "process" for CPU bound work. Process
+    # stages need a picklable func, so use a module-level function or callable object.
+    def __init__(self, name, func, executor="thread", workers=1, config=None, cache=True):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor type: {executor}")
+
+        self.name = name
+        self.func = func
+        self.executor = executor
+        self.workers = workers or os.cpu_count() or 1
+        self.config = config or {}
+        self.cache = cache
+
+    def create_executor(self):
+        if self.executor == "process":
+            return concurrent.futures.ProcessPoolExecutor(self.workers)
+        return concurrent.futures.ThreadPoolExecutor(self.workers)
+
+
+class _Instrumented:
+    # Runs in a worker process, where metrics would otherwise stay. Each call starts from empty
+    # metrics and sends what it recorded back with its result for the parent to merge.
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, value):
+        metrics.enable()
+        metrics.reset()
+        return self.func(value), metrics.snapshot()
+
+
+class StageCache:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, stage, value):
+        digest = hashlib.sha256()
+        digest.update(stage.name.encode("utf-8"))
+        digest.update(json.dumps(stage.config, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(pickle.dumps(value))
+        return digest.hexdigest()
+
+    def path(self, stage, key):
+        return os.path.join(self.cache_dir, stage.name, key[:2], f"{key}.pkl")
+
+    def get(self, stage, key):
+        path = self.path(stage, key)
+
+        if not os.path.exists(path):
+            return _MISS
+
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, stage, key, value):
+        path = self.path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+
+        with open(temp_path, "wb") as f:
+            pickle.dump(value, f)
+
+        os.replace(temp_path, path)
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=64, cache_dir=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.cache = StageCache(cache_dir) if cache_dir else None
+        self.errors = []
+
+        # Set when a stage dies, so every other thread stops instead of blocking on a full queue
+        self.__stop = threading.Event()
+        self.__failure = None
+
+    def run(self, items):
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        executors = [stage.create_executor() for stage in self.stages]
+        threads = [
+            threading.Thread(target=self.__run_stage, args=(stage, queues[i], queues[i + 1], executors[i]), daemon=True)
+            for i, stage in enumerate(self.stages)
+        ]
+        self.errors = []
+        self.__stop = threading.Event()
+        self.__failure = None
+
+        for thread in threads:
+            thread.start()
+
+        feeder = threading.Thread(target=self.__feed, args=(items, queues[0]), daemon=True)
+        feeder.start()
+
+        results = []
+
+        try:
+            while True:
+                item = self.__get(queues[-1])
+                if item is _DONE:
+                    break
+                results.append(item)
+        finally:
+            stopped = self.__stop.is_set()
+            self.__stop.set()
+            for thread in threads + [feeder]:
+                thread.join()
+            for executor in executors:
+                executor.shutdown(cancel_futures=stopped)
+
+        if self.__failure is not None:
+            name, error = self.__failure
+            raise PipelineError(f"Stage {name} stopped: {error}") from error
+
+        if self.errors:
+            logger.error(f"Pipeline finished with {len(self.errors)} failed items")
+
+        return [value for _, value in sorted(results, key=lambda item: item[0])]
+
+    def __put(self, box, item):
+        # Gives up once the pipeline is stopping, since nothing may be left to take the item
+        while not self.__stop.is_set():
+            try:
+                box.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, box):
+        while not self.__stop.is_set():
+            try:
+                return box.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def __fail(self, name, error):
+        logger.error(f"Stage {name} stopped: {error}")
+        if self.__failure is None:
+            self.__failure = (name, error)
+        self.__stop.set()
+
+    def __feed(self, items, inbox):
+        try:
+            for seq, value in enumerate(items):
+                if not self.__put(inbox, (seq, value)):
+                    return
+            self.__put(inbox, _DONE)
+        except Exception as e:
+            self.__fail("input", e)
+
+    def __run_stage(self, stage, inbox, outbox, executor):
+        # At most workers * 2 items are in flight, so a slow stage backs up the queues behind it
+        pending = {}
+        max_pending = stage.workers * 2
+        instrumented = stage.executor == "process" and metrics.enabled
+        func = _Instrumented(stage.func) if instrumented else stage.func
+
+        try:
+            while True:
+                item = self.__get(inbox)
+                if item is _DONE:
+                    break
+
+                seq, value = item
+                key = None
+
+                if self.cache is not None and stage.cache:
+                    key = self.cache.key(stage, value)
+                    cached = self.cache.get(stage, key)
+
+                    if cached is not _MISS:
+                        metrics.inc("pipeline_cache_hits_total", stage=stage.name)
+                        self.__put(outbox, (seq, cached))
+                        continue
+
+                pending[executor.submit(func, value)] = (seq, key)
+
+                if len(pending) >= max_pending:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    self.__forward(stage, done, pending, outbox, instrumented)
+
+            if pending and not self.__stop.is_set():
+                done, _ = concurrent.futures.wait(pending)
+                self.__forward(stage, done, pending, outbox, instrumented)
+        except Exception as e:
+            # e.g. BrokenProcessPool after a worker was killed, or a cache write that failed
+            self.errors.append((stage.name, None, e))
+            self.__fail(stage.name, e)
+        finally:
+            for future in pending:
+                future.cancel()
+            self.__put(outbox, _DONE)
+
+    def __forward(self, stage, done, pending, outbox, instrumented=False):
+        for future in done:
+            seq, key = pending.pop(future)
+
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Stage {stage.name} failed on item {seq}: {e}")
+                metrics.inc("pipeline_errors_total", stage=stage.name)
+                self.errors.append((stage.name, seq, e))
+                continue
+
+            if instrumented:
+                result, snapshot = result
+                metrics.merge(snapshot)
+
+            # Returning None drops the item from the rest of the pipeline
+            if result is None:
+                continue
+
+            if key is not None:
+                self.cache.put(stage, key, result)
+
+            metrics.inc("pipeline_items_total", stage=stage.name)
+            self.__put(outbox, (seq, result))
+
+
+class Fetch:
+    def __init__(self, connector, domain, username, password, texts=None):
+        self.connector = connector
+        self.texts = texts
+        self.domain = domain
+        self.username = username
+        self.password = password
+
+        self.__token = None
+        self.__lock = threading.Lock()
+
+    def token(self):
+        with self.__lock:
+            if self.__token is None:
+                self.__token = self.connector.get_access_token(self.domain, self.username, self.password)
+            return self.__token
+
+    def __call__(self, document_id):
+        token = self.token()
+        attributes = self.connector.get_document_metadata(document_id, token)
+
+        # A streamed text is written to the store and read back by the stages that need it. Its
+        # digest stands in for the text, so caches of later stages see when it changes.
+        if self.texts is not None:
+            self.connector.save_document_text(document_id, token, self.texts)
+            return {"id": document_id, "attributes": attributes, "text": None, "digest": self.texts.digest(document_id)}
+
+        text = self.connector.get_document_text(document_id, token)
+        return {"id": document_id, "attributes": attributes, "text": text}
+
+
+class Tokenize:
+    def __init__(self, tokenizer, field="tokens"):
+        self.tokenizer = tokenizer
+        self.field = field
+
+    def __call__(self, record):
+        return dict(record, **{self.field: self.tokenizer.tokenize(record["text"])})
+
+
+class ExtractFeatures:
+    def __init__(self, texts=None):
+        self.texts = texts
+
+    # A fresh vocab per record keeps the pickled result small, the corpus rebinds it on arrival
+    def __call__(self, record):
+        vocab = Vocab(Features.nlp.Defaults.stop_words)
+        text = record["text"] if record["text"] is not None else self.texts.read(record["id"])
+        return dict(record, features=Features.extract_features(text, vocab))
@@ -0,0 +1,95 @@
+# Import native libraries
+import itertools
+import math
+import random
+from typing import Any, Callable, Hashable, Iterable, List, Optional
+
+
+def _open_uniform(rng: random.Random) -> float:
+    # random() can return exactly 0.0, which the log-based skips below cannot take
+    value = rng.random()
+    while value == 0.0:
+        value = rng.random()
+    return value
+
+
+def reservoir_sample(items: Iterable[Any], n: int, seed: Optional[int] = None) -> List[Any]:
+    # Algorithm L: one pass, O(n) memory, and it skips ahead instead of drawing per item
+    rng = random.Random(seed)
+    iterator = iter(items)
+    reservoir = list(itertools.islice(iterator, n))
+
+    if n <= 0 or len(reservoir) < n:
+        return reservoir
+
+    weight = math.exp(math.log(_open_uniform(rng)) / n)
+
+    while weight < 1.0:
+        skip = math.floor(math.log(_open_uniform(rng)) / math.log(1.0 - weight))
+
+        for item in itertools.islice(iterator, skip, skip + 1):
+            reservoir[rng.randrange(n)] = item
+            break
+        else:
+            break
+
+        weight *= math.exp(math.log(_open_uniform(rng)) / n)
+
+    return reservoir
+
+
+def allocate(counts: dict, n: int, proportional: bool = True) -> dict:
+    total = sum(counts.values())
+
+    if total <= n:
+        return dict(counts)
+
+    if not proportional:
+        allocation = {stratum: 0 for stratum in counts}
+        remaining = n
+        # Round-robin so small strata are filled and their leftovers go to bigger ones
+        while remaining:
+            open_strata = [stratum for stratum in counts if allocation[stratum] < counts[stratum]]
+            for stratum in open_strata[:remaining]:
+                allocation[stratum] += 1
+            remaining -= min(remaining, len(open_strata))
+        return allocation
+
+    # Largest remainder method keeps the total exactly n
+    quotas = {stratum: n * count / total for stratum, count in counts.items()}
+    allocation = {stratum: math.floor(quota) for stratum, quota in quotas.items()}
+    leftover = n - sum(allocation.values())
+
+    for stratum in sorted(quotas, key=lambda s: quotas[s] - allocation[s], reverse=True)[:leftover]:
+        allocation[stratum] += 1
+
+    return allocation
+
+
+def stratified_sample(items: Iterable[Any], key: Callable[[Any], Hashable], n: int,
+                      seed: Optional[int] = None, proportional: bool = True) -> List[Any]:
+    # One pass: a reservoir of up to n per stratum, then each is cut down to its allocation.
+    # A uniform subset of a uniform reservoir is still a uniform sample of the stratum.
+    rng = random.Random(seed)
+    reservoirs = {}
+    counts = {}
+
+    for item in items:
+        stratum = key(item)
+        reservoir = reservoirs.setdefault(stratum, [])
+        counts[stratum] = counts.get(stratum, 0) + 1
+
+        if len(reservoir) < n:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(counts[stratum])
+            if j < n:
+                reservoir[j] = item
+
+    allocation = allocate(counts, n, proportional)
+    sample = []
+
+    for stratum, reservoir in reservoirs.items():
+        sample.extend(rng.sample(reservoir, allocation[stratum]))
+
+    return sample
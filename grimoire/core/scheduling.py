@@ -0,0 +1,290 @@
+# Import native libraries
+import json
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Import third-party libraries
+from requests.exceptions import HTTPError, RequestException
+
+# Import project code
+from grimoire.core.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITIES = (INTERACTIVE, BULK)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RequestException):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.__tokens = self.capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        # Returns 0 when the tokens were taken, otherwise how long to wait before trying again
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+
+            if self.__tokens >= tokens:
+                self.__tokens -= tokens
+                return 0.0
+
+            return (tokens - self.__tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def __getstate__(self):
+        return {"rate": self.rate, "capacity": self.capacity}
+
+    def __setstate__(self, state):
+        self.__init__(state["rate"], state["capacity"])
+
+
+class FileTokenBucket:
+    # The bucket state lives in a small file guarded by flock, so every process on the
+    # host that points at the same path draws from one shared budget
+    def __init__(self, path, rate, capacity=None):
+        if fcntl is None:
+            raise OSError("FileTokenBucket needs fcntl file locking, which this platform does not provide")
+
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.__lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        with self.__lock, open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                f.seek(0)
+                content = f.read()
+                now = time.time()
+
+                try:
+                    state = json.loads(content)
+                    available = min(self.capacity, state["tokens"] + (now - state["updated"]) * self.rate)
+                except (ValueError, KeyError):
+                    available = self.capacity
+
+                wait = 0.0
+                if available >= tokens:
+                    available -= tokens
+                else:
+                    wait = (tokens - available) / self.rate
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": available, "updated": now}))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+        return wait
+
+    def acquire(self, tokens=1):
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def __getstate__(self):
+        return {"path": self.path, "rate": self.rate, "capacity": self.capacity}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["rate"], state["capacity"])
+
+
+class CircuitBreaker:
+    # closed -> open after failure_threshold consecutive failures, then one trial call
+    # is let through after reset_timeout and its outcome closes or re-opens the circuit
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.__lock = threading.Lock()
+
+    def allow(self):
+        with self.__lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self.__lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self.__lock:
+            self.failures += 1
+
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+                    metrics.inc("circuit_opened_total")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def __getstate__(self):
+        return {"failure_threshold": self.failure_threshold, "reset_timeout": self.reset_timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state["failure_threshold"], state["reset_timeout"])
+
+
+def retry_after(exception):
+    response = getattr(exception, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exception):
+    if isinstance(exception, CircuitOpenError):
+        return False
+    response = getattr(exception, "response", None)
+    if isinstance(exception, HTTPError) and response is not None:
+        return response.status_code in RETRYABLE_STATUS
+    return True
+
+
+class RequestScheduler:
+    # Priority lanes order callers inside one process; the bucket itself may be shared
+    # across processes through a FileTokenBucket. There is no circuit breaker unless one is
+    # passed in, since an open circuit fails every request until it resets.
+    def __init__(self, rate=None, capacity=None, bucket=None, breaker=None,
+                 max_retries=2, base_delay=2.0, max_delay=60.0, seed=None):
+        if bucket is None and rate is not None:
+            bucket = TokenBucket(rate, capacity)
+
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.seed = seed
+
+        self.__rng = random.Random(seed)
+        self.__condition = threading.Condition()
+        self.__waiting = [0] * len(PRIORITIES)
+        self.__busy = False
+
+    def acquire(self, priority=BULK):
+        if self.bucket is None:
+            return
+
+        # One thread at a time waits on the bucket, and the next in line is always the
+        # highest priority waiter, so bulk ingestion cannot starve interactive requests
+        with self.__condition:
+            self.__waiting[priority] += 1
+            while self.__busy or any(self.__waiting[lane] for lane in range(priority)):
+                self.__condition.wait()
+            self.__waiting[priority] -= 1
+            self.__busy = True
+
+        try:
+            self.bucket.acquire()
+        finally:
+            with self.__condition:
+                self.__busy = False
+                self.__condition.notify_all()
+
+    def backoff(self, attempt):
+        # Full jitter spreads retries out so concurrent workers do not retry in lockstep
+        return self.__rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, priority=BULK, **kwargs):
+        attempt = 0
+
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError("Circuit is open, Doclink requests are paused")
+
+            self.acquire(priority)
+
+            try:
+                result = func(*args, **kwargs)
+            except RequestException as e:
+                # A 4xx other than 429 means Doclink answered, so it does not trip the breaker
+                if not is_retryable(e):
+                    self.__record(success=True)
+                    raise
+
+                self.__record(success=False)
+
+                if attempt >= self.max_retries:
+                    raise
+
+                delay = retry_after(e)
+                delay = self.backoff(attempt) if delay is None else min(delay, self.max_delay)
+                logger.warning(f"Request failed ({e}), retrying in {delay:.1f}s")
+                metrics.inc("http_retries_total")
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self.__record(success=True)
+            return result
+
+    def __record(self, success):
+        if self.breaker is None:
+            return
+        elif success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def __getstate__(self):
+        return {
+            "bucket": self.bucket,
+            "breaker": self.breaker,
+            "max_retries": self.max_retries,
+            "base_delay": self.base_delay,
+            "max_delay": self.max_delay,
+            "seed": self.seed,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
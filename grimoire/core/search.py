@@ -0,0 +1,195 @@
+# Import native libraries
+import logging
+import threading
+from collections import OrderedDict, deque
+
+# Import third-party libraries
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Import project code
+from grimoire.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class PatternMatcher:
+    # Aho-Corasick automaton over all patterns, so one pass over a text finds every pattern in it.
+    # Uses pyahocorasick when it is installed. The pure Python automaton only beats repeated C
+    # substring searches once there are a lot of patterns, so below AUTOMATON_MIN it is not built.
+    AUTOMATON_MIN = 512
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(patterns))
+        self.__automaton = None
+        self.__goto = None
+
+        if ahocorasick is not None:
+            self.__automaton = ahocorasick.Automaton()
+            for i, pattern in enumerate(self.patterns):
+                if pattern:
+                    self.__automaton.add_word(pattern, i)
+            if len(self.__automaton):
+                self.__automaton.make_automaton()
+            return
+
+        if len(self.patterns) < self.AUTOMATON_MIN:
+            return
+
+        self.__goto = [{}]
+        self.__fail = [0]
+        self.__output = [()]
+
+        for i, pattern in enumerate(self.patterns):
+            if pattern:
+                self.__insert(pattern, i)
+
+        self.__link()
+
+    def __insert(self, pattern, i):
+        state = 0
+
+        for char in pattern:
+            next_state = self.__goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.__goto)
+                self.__goto[state][char] = next_state
+                self.__goto.append({})
+                self.__fail.append(0)
+                self.__output.append(())
+            state = next_state
+
+        self.__output[state] += (i,)
+
+    def __link(self):
+        # Breadth first, so a state's failure target is finished before its children need it.
+        # States one character deep fail to the root, which they already do.
+        goto, fail, output = self.__goto, self.__fail, self.__output
+        queue = deque(goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, child in goto[state].items():
+                queue.append(child)
+                target = fail[state]
+
+                while target and char not in goto[target]:
+                    target = fail[target]
+
+                fail[child] = goto[target].get(char, 0)
+                output[child] += output[fail[child]]
+
+    def matches(self, text):
+        # Indexes into patterns of every pattern that occurs in text
+        found = set()
+
+        if self.__automaton is not None:
+            if len(self.__automaton):
+                for _, i in self.__automaton.iter(text):
+                    found.add(i)
+            return found
+
+        if self.__goto is None:
+            found.update(i for i, pattern in enumerate(self.patterns) if pattern and pattern in text)
+            return found
+
+        goto, fail, output = self.__goto, self.__fail, self.__output
+        state = 0
+
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            if output[state]:
+                found.update(output[state])
+
+        return found
+
+
+class SearchCache:
+    # Results are document IDs keyed by the case-folded query. Adding documents scans only the
+    # new ones for the cached queries and removing them filters the IDs out, so the cache stays
+    # valid without rescanning the corpus.
+    def __init__(self, cache_size=256):
+        self.cache_size = cache_size
+
+        self.__results = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__results)
+
+    def clear(self):
+        with self.__lock:
+            self.__results.clear()
+
+    def get(self, query):
+        with self.__lock:
+            result = self.__results.get(query)
+            if result is not None:
+                self.__results.move_to_end(query)
+            return result
+
+    def put(self, query, document_ids):
+        with self.__lock:
+            self.__results[query] = document_ids
+            self.__results.move_to_end(query)
+
+            while len(self.__results) > self.cache_size:
+                self.__results.popitem(last=False)
+
+    def add_documents(self, documents):
+        with self.__lock:
+            queries = list(self.__results)
+
+        if not queries or not documents:
+            return
+
+        hits = scan(documents, queries)
+
+        with self.__lock:
+            for query, document_ids in hits.items():
+                if query in self.__results and document_ids:
+                    self.__results[query] = self.__results[query] + document_ids
+
+    def remove_documents(self, document_ids):
+        removed = set(document_ids)
+
+        with self.__lock:
+            for query, result in self.__results.items():
+                if not removed.isdisjoint(result):
+                    self.__results[query] = tuple(document_id for document_id in result if document_id not in removed)
+
+    def __getstate__(self):
+        return {"cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["cache_size"])
+
+
+def scan(documents, queries):
+    # One pass over each text answers every query: {query: (document ID, ...)}
+    queries = list(dict.fromkeys(queries))
+    matcher = PatternMatcher(queries)
+    hits = {query: [] for query in queries}
+    empty = [query for query in queries if not query]
+
+    for doc in documents:
+        text = doc.text
+        if text is None:
+            continue
+
+        for i in matcher.matches(text.lower()):
+            hits[queries[i]].append(doc.id)
+
+        # Like str.__contains__, the empty query matches everything
+        for query in empty:
+            hits[query].append(doc.id)
+
+    metrics.inc("search_scanned_documents_total", len(documents))
+    return {query: tuple(document_ids) for query, document_ids in hits.items()}
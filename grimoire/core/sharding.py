@@ -0,0 +1,208 @@
+# Import native libraries
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from functools import partial
+
+# Import third-party libraries
+import pandas as pd
+
+# Import project code
+from grimoire.core.connectors import DoclinkConnector
+from grimoire.core.corpus import Corpus
+from grimoire.core.entities import normalize_entity
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MANIFEST = "manifest.json"
+
+
+def shard_for(document_id, num_shards):
+    # Python's hash() is salted per process, so workers need a stable digest instead
+    digest = hashlib.md5(str(document_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+# Backends run module-level task functions over argument tuples. Anything with the same
+# map(func, tasks) signature - a Dask or Ray client wrapper, say - can spread shards
+# across machines as long as they share the shard directory.
+class LocalBackend:
+    def map(self, func, tasks):
+        return [func(*task) for task in tasks]
+
+
+class ProcessBackend:
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+
+    def map(self, func, tasks):
+        with concurrent.futures.ProcessPoolExecutor(self.max_workers) as executor:
+            futures = [executor.submit(func, *task) for task in tasks]
+            return [future.result() for future in futures]
+
+
+def load_shard(shard_path, connector):
+    if os.path.exists(shard_path):
+        return Corpus.load_corpus(shard_path)
+    return Corpus(connector)
+
+
+def save_shard(corpus, shard_path):
+    # Write then rename so a crashed worker never leaves a half-written shard behind
+    temp_path = f"{shard_path}.tmp"
+    corpus.save_corpus(temp_path)
+    os.replace(temp_path, shard_path)
+
+
+def ingest_shard(shard_path, connector, document_ids, domain, username, password):
+    corpus = load_shard(shard_path, connector)
+    corpus.add_documents(document_ids, domain, username, password)
+    save_shard(corpus, shard_path)
+    return len(corpus.documents)
+
+
+def apply_shard(shard_path, connector, func, save):
+    corpus = load_shard(shard_path, connector)
+    result = func(corpus)
+
+    if save:
+        save_shard(corpus, shard_path)
+
+    return result
+
+
+def extract_shard_features(corpus, n_process=1, batch_size=4):
+    corpus.extract_features(n_process=n_process, batch_size=batch_size)
+    return len(corpus.documents)
+
+
+def corpus_statistics(corpus):
+    stats = Counter(documents=len(corpus.documents))
+
+    for doc in corpus.documents:
+        features = doc.features
+        stats["tokens"] += len(features.orth)
+        stats["entities"] += len(features.entities)
+
+        for _, _, _, label in features.entities:
+            stats[f"entities:{label}"] += 1
+
+    return stats
+
+
+def shard_entity_postings(corpus):
+    # Normalised entity -> [(document ID, start, end, surface text, label), ...]
+    postings = {}
+
+    for doc in corpus.documents:
+        for text, start, end, label in doc.features.entities:
+            postings.setdefault(normalize_entity(text), []).append((doc.id, start, end, text, label))
+
+    return postings
+
+
+def shard_feature_table(corpus):
+    # One row per token, as in Features.summarize_features, with the document it came from
+    frames = []
+
+    for doc in corpus.documents:
+        frame = doc.features.summarize_features()
+        frame.insert(0, "DOCUMENT_ID", doc.id)
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def merge_counters(results):
+    merged = Counter()
+    for result in results:
+        merged.update(result)
+    return merged
+
+
+def merge_postings(results):
+    merged = {}
+    for result in results:
+        for key, postings in result.items():
+            merged.setdefault(key, []).extend(postings)
+    return merged
+
+
+def merge_frames(results):
+    frames = [result for result in results if result is not None]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+class ShardedCorpus:
+    def __init__(self, path, num_shards=16, connector=None, backend=None):
+        self.path = path
+        self.connector = connector if connector is not None else DoclinkConnector()
+        self.backend = backend if backend is not None else ProcessBackend()
+
+        manifest_path = os.path.join(path, MANIFEST)
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.num_shards = json.load(f)["num_shards"]
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.num_shards = num_shards
+
+            with open(manifest_path, "w") as f:
+                json.dump({"num_shards": num_shards}, f)
+
+        logger.info(f"Opened sharded corpus at {path} with {self.num_shards} shards")
+
+    def shard_path(self, shard):
+        return os.path.join(self.path, f"shard-{shard:05d}.pkl")
+
+    def existing_shards(self):
+        return [shard for shard in range(self.num_shards) if os.path.exists(self.shard_path(shard))]
+
+    def partition(self, document_ids):
+        partitions = {}
+        for document_id in document_ids:
+            partitions.setdefault(shard_for(document_id, self.num_shards), []).append(document_id)
+        return partitions
+
+    def load_shard(self, shard):
+        return load_shard(self.shard_path(shard), self.connector)
+
+    def add_documents(self, document_ids, domain, username, password):
+        partitions = self.partition(document_ids)
+        tasks = [
+            (self.shard_path(shard), self.connector, ids, domain, username, password)
+            for shard, ids in sorted(partitions.items())
+        ]
+        sizes = self.backend.map(ingest_shard, tasks)
+        logger.info(f"Ingested {len(document_ids)} documents into {len(tasks)} shards")
+        return dict(zip(sorted(partitions), sizes))
+
+    def map(self, func, save=False, shards=None):
+        shards = self.existing_shards() if shards is None else shards
+        tasks = [(self.shard_path(shard), self.connector, func, save) for shard in shards]
+        return self.backend.map(apply_shard, tasks)
+
+    def map_reduce(self, func, merge, save=False, shards=None):
+        return merge(self.map(func, save, shards))
+
+    def extract_features(self, n_process=1, batch_size=4):
+        func = partial(extract_shard_features, n_process=n_process, batch_size=batch_size)
+        return self.map_reduce(func, sum, save=True)
+
+    def statistics(self):
+        return self.map_reduce(corpus_statistics, merge_counters)
+
+    def entity_postings(self):
+        return self.map_reduce(shard_entity_postings, merge_postings)
+
+    def feature_table(self, shards=None):
+        # Token level, so pass shards to build it for part of a large corpus
+        return self.map_reduce(shard_feature_table, merge_frames, shards=shards)
+
+    def get_document_by_id(self, document_id):
+        return self.load_shard(shard_for(document_id, self.num_shards)).get_document_by_id(document_id)
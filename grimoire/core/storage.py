@@ -0,0 +1,324 @@
+# Import native libraries
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+# Import third-party libraries
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+class CompressedTextStore(MutableMapping):
+    # Each text is compressed on its own against a dictionary shared by the whole corpus,
+    # so boilerplate compresses well and any single document can still be read directly.
+    def __init__(self, level=3, dict_size=112640, cache_size=1024):
+        if zstandard is None:
+            raise ImportError("CompressedTextStore requires the zstandard package: pip install zstandard")
+
+        self.level = level
+        self.dict_size = dict_size
+        self.cache_size = cache_size
+        self.dictionary = None
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+        self.__blobs = {}
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    # zstd contexts are not thread safe, so every thread gets its own pair
+    def __codecs(self):
+        codecs = getattr(self.__local, "codecs", None)
+
+        if codecs is None or codecs[0] is not self.dictionary:
+            if self.dictionary is not None:
+                compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+                decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+            else:
+                compressor = zstandard.ZstdCompressor(level=self.level)
+                decompressor = zstandard.ZstdDecompressor()
+            codecs = self.__local.codecs = (self.dictionary, compressor, decompressor)
+
+        return codecs
+
+    def train(self, samples):
+        samples = [sample.encode("utf-8") for sample in samples if sample]
+
+        try:
+            dictionary = zstandard.train_dictionary(self.dict_size, samples)
+        except zstandard.ZstdError as e:
+            logger.warning(f"Could not train a compression dictionary, compressing without one: {e}")
+            return
+
+        # Re-encode what is already stored so every blob uses the new dictionary
+        texts = {key: self[key] for key in self.__blobs}
+        self.dictionary = dictionary
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.__blobs.clear()
+
+        for key, text in texts.items():
+            self[key] = text
+
+        logger.info(f"Trained a {len(dictionary.as_bytes())} byte compression dictionary on {len(samples)} samples")
+
+    def compression_ratio(self):
+        return self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 1.0
+
+    def __getitem__(self, key):
+        with self.__lock:
+            text = self.__cache.get(key)
+            if text is not None:
+                self.__cache.move_to_end(key)
+                return text
+
+        blob = self.__blobs[key]
+        text = self.__codecs()[2].decompress(blob).decode("utf-8")
+
+        with self.__lock:
+            self.__cache[key] = text
+            if len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+
+        return text
+
+    def __setitem__(self, key, text):
+        raw = text.encode("utf-8")
+        blob = self.__codecs()[1].compress(raw)
+
+        with self.__lock:
+            previous = self.__blobs.get(key)
+            if previous is not None:
+                self.compressed_bytes -= len(previous)
+                self.raw_bytes -= zstandard.frame_content_size(previous)
+
+            self.__blobs[key] = blob
+            self.raw_bytes += len(raw)
+            self.compressed_bytes += len(blob)
+            self.__cache.pop(key, None)
+
+    def __delitem__(self, key):
+        with self.__lock:
+            blob = self.__blobs.pop(key)
+            self.compressed_bytes -= len(blob)
+            self.raw_bytes -= zstandard.frame_content_size(blob)
+            self.__cache.pop(key, None)
+
+    def __iter__(self):
+        return iter(list(self.__blobs))
+
+    def __len__(self):
+        return len(self.__blobs)
+
+    def __contains__(self, key):
+        return key in self.__blobs
+
+    def __getstate__(self):
+        return {
+            "level": self.level,
+            "dict_size": self.dict_size,
+            "cache_size": self.cache_size,
+            "dictionary": self.dictionary.as_bytes() if self.dictionary is not None else None,
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "blobs": self.__blobs,
+        }
+
+    def __setstate__(self, state):
+        if zstandard is None:
+            raise ImportError("Loading compressed texts requires the zstandard package: pip install zstandard")
+
+        dictionary = state["dictionary"]
+        self.level = state["level"]
+        self.dict_size = state["dict_size"]
+        self.cache_size = state["cache_size"]
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary is not None else None
+        self.raw_bytes = state["raw_bytes"]
+        self.compressed_bytes = state["compressed_bytes"]
+
+        self.__blobs = state["blobs"]
+        self.__cache = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+
+class DiskTextStore(MutableMapping):
+    # One UTF-8 file per document, so texts can be streamed in and memory-mapped out
+    # without ever holding a whole document in memory
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.__keys = {}
+        self.__lock = threading.Lock()
+
+    def path(self, key):
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name[:2], name + ".txt")
+
+    @contextmanager
+    def writer(self, key):
+        # Writes go to a temporary file that only replaces the stored text once complete
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+        with self.__lock:
+            self.__keys[key] = None
+
+    def register(self, key):
+        # Adopts a text another process or an earlier session already wrote for this key
+        if not os.path.exists(self.path(key)):
+            raise KeyError(key)
+
+        with self.__lock:
+            self.__keys[key] = None
+
+    def digest(self, key):
+        # sha256 of the stored text, read in chunks
+        digest = hashlib.sha256()
+
+        with open(self.path(key), "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def size(self, key):
+        if key not in self.__keys:
+            raise KeyError(key)
+        return os.path.getsize(self.path(key))
+
+    def view(self, key):
+        # A read-only mmap of the UTF-8 bytes, for scanning a text without decoding it
+        if key not in self.__keys:
+            raise KeyError(key)
+
+        with open(self.path(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, key):
+        # Goes by the file alone, so a copy of the store in another process can read texts written after it was made
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read().decode("utf-8", errors="replace")
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def __getitem__(self, key):
+        if key not in self.__keys:
+            raise KeyError(key)
+        return self.read(key)
+
+    def __setitem__(self, key, text):
+        with self.writer(key) as f:
+            f.write(text.encode("utf-8"))
+
+    def __delitem__(self, key):
+        with self.__lock:
+            del self.__keys[key]
+
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def __iter__(self):
+        return iter(list(self.__keys))
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __contains__(self, key):
+        return key in self.__keys
+
+    def __getstate__(self):
+        return {"directory": self.directory, "max_bytes": self.max_bytes, "keys": list(self.__keys)}
+
+    def __setstate__(self, state):
+        self.directory = state["directory"]
+        self.max_bytes = state["max_bytes"]
+        self.__keys = dict.fromkeys(state["keys"])
+        self.__lock = threading.Lock()
+
+
+class DocumentStore:
+    def __init__(self, texts=None):
+        # texts is any mutable mapping of document ID to text: a dict, a CompressedTextStore
+        # or a DiskTextStore
+        self.texts = texts if texts is not None else {}
+        self.features = {}
+        # Bumped on every put_features, so anything derived from a document's features can tell
+        # they were extracted again even when the token and entity counts did not change
+        self.revision = 0
+        self.revisions = {}
+
+    def __contains__(self, document_id):
+        return document_id in self.texts
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def streams_text(self):
+        # Stores with a writer can take a download chunk by chunk instead of as one string
+        return hasattr(self.texts, "writer")
+
+    def use_texts(self, texts):
+        for document_id in list(self.texts):
+            texts[document_id] = self.texts[document_id]
+        self.texts = texts
+
+    def get_text(self, document_id):
+        return self.texts.get(document_id)
+
+    def put_text(self, document_id, text):
+        if text is None:
+            self.texts.pop(document_id, None)
+        else:
+            self.texts[document_id] = text
+
+    def get_features(self, document_id):
+        return self.features.get(document_id)
+
+    def put_features(self, document_id, features):
+        self.features[document_id] = features
+        self.revision += 1
+        self.revisions[document_id] = self.revision
+
+    def features_revision(self, document_id):
+        return self.revisions.get(document_id)
+
+    def remove_features(self, document_ids):
+        for document_id in document_ids:
+            self.features.pop(document_id, None)
+            self.revisions.pop(document_id, None)
+
+    def remove(self, document_ids):
+        for document_id in document_ids:
+            self.texts.pop(document_id, None)
+            self.features.pop(document_id, None)
+            self.revisions.pop(document_id, None)
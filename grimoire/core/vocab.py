@@ -0,0 +1,77 @@
+# Import native libraries
+from array import array
+from typing import Iterable, List, Union
+
+# Import project code
+from grimoire.nlp.lexemes import LexemeTable
+
+
+class StringStore:
+    def __init__(self, strings: Iterable[str] = ()):
+        self.strings = []
+        self.__string_to_id = {}
+
+        for string in strings:
+            self.add(string)
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __iter__(self):
+        return iter(self.strings)
+
+    def __contains__(self, string: str) -> bool:
+        return string in self.__string_to_id
+
+    def __getitem__(self, key: Union[int, str]) -> Union[str, int]:
+        if isinstance(key, int):
+            return self.strings[key]
+        return self.__string_to_id[key]
+
+    def add(self, string: str) -> int:
+        string_id = self.__string_to_id.get(string)
+
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.__string_to_id[string] = string_id
+
+        return string_id
+
+    def add_many(self, strings: Iterable[str]) -> array:
+        return array("L", (self.add(string) for string in strings))
+
+    def decode_many(self, string_ids: Iterable[int]) -> List[str]:
+        strings = self.strings
+        return [strings[string_id] for string_id in string_ids]
+
+    def encode(self, value):
+        # Keys become ids, string values collapse onto the store's single copy
+        if isinstance(value, dict):
+            return {self.add(key): self.encode(item) for key, item in value.items()}
+        elif isinstance(value, list):
+            return [self.encode(item) for item in value]
+        elif isinstance(value, str):
+            return self.strings[self.add(value)]
+        return value
+
+    def decode(self, value):
+        if isinstance(value, dict):
+            return {self.strings[key]: self.decode(item) for key, item in value.items()}
+        elif isinstance(value, list):
+            return [self.decode(item) for item in value]
+        return value
+
+    # The reverse lookup is rebuilt on load so saved corpora only carry the list
+    def __getstate__(self):
+        return {"strings": self.strings}
+
+    def __setstate__(self, state):
+        self.strings = state["strings"]
+        self.__string_to_id = {string: i for i, string in enumerate(self.strings)}
+
+
+class Vocab:
+    def __init__(self, stop_words: Iterable[str] = ()):
+        self.strings = StringStore()
+        self.lexemes = LexemeTable(stop_words)
@@ -1,13 +1,24 @@
 # Import native libraries
 import logging
+import time
+from array import array
 
 # Import third-party libraries
 import pandas as pd
 import spacy
 
+# Import project code
+from grimoire.core.metrics import metrics
+from grimoire.core.vocab import Vocab
+from grimoire.nlp.lexemes import ALPHA, LOWER, NUMERIC, STOP, TITLE, UPPER
+from grimoire.nlp.splitter import Splitter
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Characters of context either side of a window's core
+WINDOW_OVERLAP = 1000
+
 # Corpus - highest level class containing a collection of Documents
 # Document - class represents an individual document
 # Doc - spaCy Doc object containing linguistic annotations
@@ -26,56 +37,196 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 class Features:
     logger.info("Loading NLP model ... ")
     nlp = spacy.load("/models/en_core_web_lg-3.4.0/")
+    vocab = Vocab(nlp.Defaults.stop_words)
+    # max_chars bounds a window's core, and the whole window with its overlap has to fit the parser
+    splitter = Splitter(max_chars=min(100000, nlp.max_length) - 2 * WINDOW_OVERLAP, overlap=WINDOW_OVERLAP)
 
-    def __init__(self):
+    def __init__(self, vocab=None):
         # Document level
         self.noun_chunks = []
         self.entities = [] 
 
-        # Token level
-        self.tokens = []
-        self.lemma = []
-        self.syntax = []
-        self.tags = []
-        self.dep = []
-        self.shape = []
-        self.alpha = []
-        self.stopword = []
-        self.lowercase = []
-        self.uppercase = []
-        self.titlecase = []
-        self.numeric = []
+        # String ids into the shared vocab - lemma, syntax, tags and dep decode them to text
+        self.vocab = vocab if vocab is not None else type(self).vocab
+        self.lemma_ids = array("L")
+        self.syntax_ids = array("L")
+        self.tags_ids = array("L")
+        self.dep_ids = array("L")
+
+        # Lexeme ids into the shared table - flags and shape are looked up, not recomputed
+        self.orth = array("L")
+
+        # Character offset of each token in the document text
+        self.idx = array("L")
+
+    @property
+    def lexemes(self):
+        return self.vocab.lexemes
+
+    # Token texts come from the lexeme table so features hold no spaCy objects and pickle cleanly
+    @property
+    def tokens(self):
+        forms = self.lexemes.forms
+        return [forms[lex_id] for lex_id in self.orth]
+
+    @property
+    def lemma(self):
+        return self.vocab.strings.decode_many(self.lemma_ids)
+
+    @lemma.setter
+    def lemma(self, lemma):
+        self.lemma_ids = self.vocab.strings.add_many(lemma)
+
+    @property
+    def syntax(self):
+        return self.vocab.strings.decode_many(self.syntax_ids)
+
+    @syntax.setter
+    def syntax(self, syntax):
+        self.syntax_ids = self.vocab.strings.add_many(syntax)
+
+    @property
+    def tags(self):
+        return self.vocab.strings.decode_many(self.tags_ids)
 
+    @tags.setter
+    def tags(self, tags):
+        self.tags_ids = self.vocab.strings.add_many(tags)
+
+    @property
+    def dep(self):
+        return self.vocab.strings.decode_many(self.dep_ids)
+
+    @dep.setter
+    def dep(self, dep):
+        self.dep_ids = self.vocab.strings.add_many(dep)
+
+    @property
+    def shape(self):
+        return self.lexemes.shape_column(self.orth)
+
+    @property
+    def alpha(self):
+        return self.lexemes.flag_column(self.orth, ALPHA)
+
+    @property
+    def stopword(self):
+        return self.lexemes.flag_column(self.orth, STOP)
+
+    @property
+    def lowercase(self):
+        return self.lexemes.flag_column(self.orth, LOWER)
+
+    @property
+    def uppercase(self):
+        return self.lexemes.flag_column(self.orth, UPPER)
+
+    @property
+    def titlecase(self):
+        return self.lexemes.flag_column(self.orth, TITLE)
+
+    @property
+    def numeric(self):
+        return self.lexemes.flag_column(self.orth, NUMERIC)
 
     @classmethod
-    def extract_features(cls, text):
-        logger.info("Creating features ...")
-        
-        features = cls()
-        doc = cls.nlp(text)
+    def parse(cls, text):
+        if not metrics.enabled:
+            return cls.nlp(text)
+
+        start = time.perf_counter()
+        doc = cls.__run_components(text)
+        cls.__record(len(doc), time.perf_counter() - start)
+        return doc
+
+    @classmethod
+    def __run_components(cls, text):
+        # Run the pipeline component by component so each one gets its own timer
+        with metrics.timer("spacy_component_seconds", component="tokenizer"):
+            doc = cls.nlp.make_doc(text)
+
+        for name, component in cls.nlp.pipeline:
+            with metrics.timer("spacy_component_seconds", component=name):
+                doc = component(doc)
+
+        return doc
+
+    @staticmethod
+    def __record(tokens, elapsed):
+        metrics.inc("nlp_documents_total")
+        metrics.inc("nlp_tokens_total", tokens)
+        metrics.observe("nlp_document_seconds", elapsed)
+
+        if elapsed > 0:
+            metrics.set("nlp_tokens_per_second", tokens / elapsed)
+
+    @classmethod
+    def extract_features(cls, text, vocab=None, n_process=1, batch_size=4):
+        logger.debug("Creating features ...")
         
+        features = cls(vocab)
+        windows = cls.splitter.split(text)
+
+        if len(windows) == 1:
+            features.add_doc(cls.parse(text), 0, 0, len(text))
+            return features
+
+        # Long documents are parsed window by window so parser memory stays bounded,
+        # then each window's tokens and spans are shifted back into document offsets
+        logger.debug(f"Splitting document of {len(text)} characters into {len(windows)} windows")
+
+        start = time.perf_counter()
+        texts = (text[window.start:window.end] for window in windows)
+        docs = cls.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+        for window, doc in zip(windows, docs):
+            features.add_doc(doc, window.start, window.core_start, window.core_end)
+
+        # nlp.pipe runs the components itself, so only the whole document is timed. It counts once,
+        # with the tokens kept from each window's core.
+        if metrics.enabled:
+            cls.__record(len(features.orth), time.perf_counter() - start)
+            metrics.inc("nlp_windows_total", len(windows))
+
+        return features
+
+    def add_doc(self, doc, offset, core_start, core_end):
+        # Only tokens and spans starting inside the core are kept, the overlap is context
+        strings = self.vocab.strings
+        lexemes = self.vocab.lexemes
+        tokens = [token for token in doc if core_start <= offset + token.idx < core_end]
+
         # Extract features using spaCy
-        features.noun_chunks = list(doc.noun_chunks)
-        features.tokens = [token for token in doc]
-        features.lemma = [token.lemma_ for token in features.tokens]
-        features.syntax = [token.pos_ for token in features.tokens]
-        features.tags = [token.tag_ for token in features.tokens]
-        features.dep = [token.dep_ for token in features.tokens]
-        features.shape = [token.shape_ for token in features.tokens]
-        features.alpha = [token.is_alpha for token in features.tokens]
-        features.stopword = [token.is_stop for token in features.tokens]
+        self.lemma_ids.extend(strings.add_many(token.lemma_ for token in tokens))
+        self.syntax_ids.extend(strings.add_many(token.pos_ for token in tokens))
+        self.tags_ids.extend(strings.add_many(token.tag_ for token in tokens))
+        self.dep_ids.extend(strings.add_many(token.dep_ for token in tokens))
+        self.orth.extend(lexemes.add_many(token.text for token in tokens))
+        self.idx.extend(offset + token.idx for token in tokens)
+
+        for chunk in doc.noun_chunks:
+            if core_start <= offset + chunk.start_char < core_end:
+                self.noun_chunks.append((chunk.text, offset + chunk.start_char, offset + chunk.end_char))
 
         for ent in doc.ents:
-            features.entities.append((ent.text, ent.start_char, ent.end_char, ent.label_))
+            if core_start <= offset + ent.start_char < core_end:
+                self.entities.append((ent.text, offset + ent.start_char, offset + ent.end_char, ent.label_))
 
-        # Use native Python functions to create additional features
-        features.lowercase = [str(token).islower() for token in features.tokens]
-        features.uppercase = [str(token).isupper() for token in features.tokens]
-        features.titlecase = [str(token).istitle() for token in features.tokens]
-        features.numeric = [str(token).isnumeric() for token in features.tokens]
-        
+    def rebind(self, vocab):
+        if vocab is self.vocab:
+            return self
+
+        features = type(self)(vocab)
+        features.noun_chunks = self.noun_chunks
+        features.entities = self.entities
+
+        # The string properties decode from this vocab and the setters encode into the new one
+        for name in ("lemma", "syntax", "tags", "dep"):
+            setattr(features, name, getattr(self, name))
+
+        features.orth = vocab.lexemes.add_many(self.tokens)
+        features.idx = self.idx
         return features
-    
 
     def summarize_features(self):
         columns = ["TOKEN", "LEMMA", "POS", "TAG", "DEP", "SHAPE", "ALPHA", "STOP", "LOWER", "UPPER", "TITLE", "NUMERIC"]
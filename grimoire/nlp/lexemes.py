@@ -0,0 +1,130 @@
+# Import native libraries
+import unicodedata
+from array import array
+from typing import Iterable, List
+
+# Lexeme flags - each distinct word form gets a bitmask of these computed once
+LOWER = 1 << 0
+UPPER = 1 << 1
+TITLE = 1 << 2
+NUMERIC = 1 << 3
+ALPHA = 1 << 4
+DIGIT = 1 << 5
+STOP = 1 << 6
+PUNCT = 1 << 7
+SPACE = 1 << 8
+
+
+def word_shape(text: str) -> str:
+    # Same scheme as spaCy's shape_: Xxxx, dd, xxxx. with runs capped at four
+    if len(text) >= 100:
+        return "LONG"
+
+    shape = []
+    last = ""
+    seq = 0
+
+    for char in text:
+        if char.isalpha():
+            shape_char = "X" if char.isupper() else "x"
+        elif char.isdigit():
+            shape_char = "d"
+        else:
+            shape_char = char
+
+        if shape_char == last:
+            seq += 1
+        else:
+            seq = 0
+            last = shape_char
+
+        if seq < 4:
+            shape.append(shape_char)
+
+    return "".join(shape)
+
+
+def lexeme_flags(text: str, stop_words: frozenset) -> int:
+    flags = 0
+
+    if text.islower():
+        flags |= LOWER
+    if text.isupper():
+        flags |= UPPER
+    if text.istitle():
+        flags |= TITLE
+    if text.isnumeric():
+        flags |= NUMERIC
+    if text.isalpha():
+        flags |= ALPHA
+    if text.isdigit():
+        flags |= DIGIT
+    if text.lower() in stop_words:
+        flags |= STOP
+    if text and all(unicodedata.category(char).startswith("P") for char in text):
+        flags |= PUNCT
+    if text.isspace():
+        flags |= SPACE
+
+    return flags
+
+
+class LexemeTable:
+    def __init__(self, stop_words: Iterable[str] = ()):
+        self.stop_words = frozenset(word.lower() for word in stop_words)
+        self.forms = []
+        self.flags = array("H")
+        self.shapes = []
+
+        self.__form_to_id = {}
+
+    def __len__(self) -> int:
+        return len(self.forms)
+
+    def __contains__(self, form: str) -> bool:
+        return form in self.__form_to_id
+
+    def add(self, form: str) -> int:
+        lex_id = self.__form_to_id.get(form)
+
+        if lex_id is None:
+            lex_id = len(self.forms)
+            self.forms.append(form)
+            self.flags.append(lexeme_flags(form, self.stop_words))
+            self.shapes.append(word_shape(form))
+            self.__form_to_id[form] = lex_id
+
+        return lex_id
+
+    def add_many(self, forms: Iterable[str]) -> array:
+        return array("L", (self.add(form) for form in forms))
+
+    def has_flag(self, lex_id: int, flag: int) -> bool:
+        return bool(self.flags[lex_id] & flag)
+
+    def case(self, lex_id: int) -> str:
+        flags = self.flags[lex_id]
+
+        if flags & LOWER:
+            return "lowercase"
+        elif flags & UPPER:
+            return "uppercase"
+        elif flags & TITLE:
+            return "capitalized"
+        else:
+            return "mixed"
+
+    def flag_column(self, lex_ids: Iterable[int], flag: int) -> List[bool]:
+        flags = self.flags
+        return [bool(flags[lex_id] & flag) for lex_id in lex_ids]
+
+    def shape_column(self, lex_ids: Iterable[int]) -> List[str]:
+        shapes = self.shapes
+        return [shapes[lex_id] for lex_id in lex_ids]
+
+    def __getstate__(self):
+        return {"stop_words": self.stop_words, "forms": self.forms, "flags": self.flags, "shapes": self.shapes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__form_to_id = {form: i for i, form in enumerate(self.forms)}
@@ -0,0 +1,90 @@
+# Import native libraries
+import bisect
+import re
+from typing import List, NamedTuple
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"[.!?][\"')\]]*\s+")
+WHITESPACE = re.compile(r"\s")
+
+
+class Window(NamedTuple):
+    # start/end is the text handed to the parser, core_start/core_end the part it owns
+    start: int
+    end: int
+    core_start: int
+    core_end: int
+
+
+class Splitter:
+    def __init__(self, max_chars=100000, overlap=1000, unit="paragraph"):
+        if unit not in ("paragraph", "sentence"):
+            raise ValueError(f"Unknown split unit: {unit}")
+
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self.unit = unit
+
+    def boundaries(self, text):
+        sentences = [match.end() for match in SENTENCE_BREAK.finditer(text)]
+
+        if self.unit == "sentence":
+            return sentences, set()
+
+        # Paragraph pieces that are still too long fall back to sentence breaks
+        paragraphs = {match.end() for match in PARAGRAPH_BREAK.finditer(text)}
+        return sorted(paragraphs.union(sentences)), paragraphs
+
+    @staticmethod
+    def hard_cut(text, start, limit):
+        for i in range(limit, start, -1):
+            if text[i - 1].isspace():
+                return i
+        return limit
+
+    def snap_left(self, text, core_start):
+        low = max(0, core_start - self.overlap)
+        match = WHITESPACE.search(text, low, core_start)
+        return match.end() if match and low > 0 else low
+
+    def snap_right(self, text, core_end):
+        high = min(len(text), core_end + self.overlap)
+        if high == len(text):
+            return high
+        for i in range(high, core_end, -1):
+            if text[i - 1].isspace():
+                return i
+        return core_end
+
+    def split(self, text) -> List[Window]:
+        length = len(text)
+
+        if length <= self.max_chars:
+            return [Window(0, length, 0, length)]
+
+        points, paragraphs = self.boundaries(text)
+        windows = []
+        start = 0
+
+        while start < length:
+            limit = start + self.max_chars
+
+            if limit >= length:
+                end = length
+            else:
+                # Prefer the last paragraph break in range, then the last sentence break
+                i = bisect.bisect_right(points, limit) - 1
+                candidates = points[bisect.bisect_right(points, start):i + 1]
+                end = None
+
+                if paragraphs:
+                    paragraph_ends = [point for point in candidates if point in paragraphs]
+                    end = paragraph_ends[-1] if paragraph_ends else None
+
+                if end is None:
+                    end = candidates[-1] if candidates else self.hard_cut(text, start, limit)
+
+            windows.append(Window(self.snap_left(text, start), self.snap_right(text, end), start, end))
+            start = end
+
+        return windows
@@ -0,0 +1,200 @@
+# Import native libraries
+import json
+import logging
+import os
+import time
+
+# Import third-party libraries
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:
+    AutoTokenizer = None
+
+# Import project code
+from grimoire.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MANIFEST = "manifest.json"
+ARRAYS = ("input_ids", "attention_mask", "offsets", "windows")
+
+
+class SubwordTokenizer:
+    def __init__(self, model, max_length=512, stride=128, batch_size=64, bucket_width=64, local_files_only=True):
+        if isinstance(model, str):
+            if AutoTokenizer is None:
+                raise ImportError("SubwordTokenizer requires the transformers package: pip install transformers")
+            self.name = model
+            self.model = AutoTokenizer.from_pretrained(model, use_fast=True, local_files_only=local_files_only)
+        else:
+            self.name = getattr(model, "name_or_path", type(model).__name__)
+            self.model = model
+
+        # Offset mappings only come from the Rust backed tokenizers
+        if not getattr(self.model, "is_fast", False):
+            raise ValueError(f"Tokenizer {self.name} is not a fast tokenizer, offset mappings are unavailable")
+
+        self.max_length = max_length
+        self.stride = stride
+        self.batch_size = batch_size
+        self.bucket_width = bucket_width
+        self.pad_token_id = self.model.pad_token_id if self.model.pad_token_id is not None else 0
+
+    def tokenize(self, text):
+        return self.model.tokenize(text)
+
+    def encode_batch(self, texts):
+        # Long texts overflow into several windows of at most max_length, overlapping by stride
+        encoded = self.model(
+            texts,
+            max_length=self.max_length,
+            stride=self.stride,
+            truncation=True,
+            padding=False,
+            return_overflowing_tokens=True,
+            return_offsets_mapping=True,
+            return_attention_mask=False,
+        )
+
+        windows = []
+        seen = {}
+
+        for ids, offsets, sample in zip(encoded["input_ids"], encoded["offset_mapping"], encoded["overflow_to_sample_mapping"]):
+            number = seen.get(sample, 0)
+            seen[sample] = number + 1
+            windows.append((sample, number, ids, offsets))
+
+        return windows
+
+    def bucket_length(self, length):
+        return min(self.max_length, -(-length // self.bucket_width) * self.bucket_width)
+
+    def encode_corpus(self, documents, directory, shard_size=4096):
+        if np is None:
+            raise ImportError("Writing subword shards requires the numpy package: pip install numpy")
+
+        start = time.perf_counter()
+        os.makedirs(directory, exist_ok=True)
+        writer = _ShardWriter(directory, self.pad_token_id, shard_size)
+        document_ids = []
+
+        for first in range(0, len(documents), self.batch_size):
+            batch = documents[first:first + self.batch_size]
+            document_ids.extend(doc.id for doc in batch)
+
+            for sample, number, ids, offsets in self.encode_batch([doc.text or "" for doc in batch]):
+                writer.add(self.bucket_length(len(ids)), first + sample, number, ids, offsets)
+
+        writer.close()
+
+        manifest = {
+            "model": self.name,
+            "max_length": self.max_length,
+            "stride": self.stride,
+            "pad_token_id": self.pad_token_id,
+            "documents": document_ids,
+            "shards": writer.shards,
+        }
+
+        tmp = os.path.join(directory, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(directory, MANIFEST))
+
+        rows = sum(shard["rows"] for shard in writer.shards)
+        metrics.inc("subword_windows_total", rows)
+        metrics.observe("subword_seconds", time.perf_counter() - start)
+        logger.info(f"Encoded {len(documents)} documents into {rows} windows across {len(writer.shards)} shards")
+
+        return SubwordShards(directory)
+
+
+class _ShardWriter:
+    # Windows wait in a per-length buffer and are written out a full shard at a time
+    def __init__(self, directory, pad_token_id, shard_size):
+        self.directory = directory
+        self.pad_token_id = pad_token_id
+        self.shard_size = shard_size
+        self.shards = []
+        self.__buffers = {}
+
+    def add(self, length, row, number, ids, offsets):
+        buffer = self.__buffers.setdefault(length, [])
+        buffer.append((row, number, ids, offsets))
+
+        if len(buffer) >= self.shard_size:
+            self.flush(length)
+
+    def flush(self, length):
+        buffer = self.__buffers.pop(length, [])
+        if not buffer:
+            return
+
+        name = f"len{length:05d}-{len(self.shards):05d}"
+        arrays = self.__allocate(name, len(buffer), length)
+
+        for i, (row, number, ids, offsets) in enumerate(buffer):
+            n = len(ids)
+            arrays["input_ids"][i, :n] = ids
+            arrays["attention_mask"][i, :n] = 1
+            arrays["offsets"][i, :n] = offsets
+            arrays["windows"][i] = (row, number)
+
+        for array in arrays.values():
+            array.flush()
+
+        self.shards.append({"name": name, "length": length, "rows": len(buffer)})
+
+    def __allocate(self, name, rows, length):
+        def open_array(field, dtype, shape, fill):
+            path = os.path.join(self.directory, f"{name}.{field}.npy")
+            array = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+            array[...] = fill
+            return array
+
+        return {
+            "input_ids": open_array("input_ids", np.int32, (rows, length), self.pad_token_id),
+            "attention_mask": open_array("attention_mask", np.int8, (rows, length), 0),
+            "offsets": open_array("offsets", np.int32, (rows, length, 2), 0),
+            "windows": open_array("windows", np.int64, (rows, 2), 0),
+        }
+
+    def close(self):
+        for length in sorted(self.__buffers):
+            self.flush(length)
+
+
+class SubwordShards:
+    # windows holds (document row, window number); document row indexes into documents
+    def __init__(self, directory, mmap_mode="r"):
+        if np is None:
+            raise ImportError("Reading subword shards requires the numpy package: pip install numpy")
+
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+
+        self.documents = self.manifest["documents"]
+        self.shards = self.manifest["shards"]
+
+    def __len__(self):
+        return sum(shard["rows"] for shard in self.shards)
+
+    def load(self, shard):
+        arrays = {
+            field: np.load(os.path.join(self.directory, f"{shard['name']}.{field}.npy"), mmap_mode=self.mmap_mode)
+            for field in ARRAYS
+        }
+        return dict(arrays, length=shard["length"])
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield self.load(shard)
@@ -18,6 +18,7 @@ class FeatureEngineer:
     def __init__(self):
         logging.info('Initializing FeatureEngineer...')
         self.nlp = spacy.load('en_core_web_sm')
+        self.stopwords = frozenset(stopwords.words('english'))
 
     def load_text(self, text):
         logging.info("Loading text...")
@@ -88,7 +89,7 @@ class FeatureEngineer:
         return token == '\n'
 
     def is_stopword(self, token):
-        return token.lower() in nltk.corpus.stopwords.words('english')
+        return token.lower() in self.stopwords
 
     def pos_tags(self):
         doc = self.nlp(' '.join(self.tokens))
@@ -0,0 +1,154 @@
+import pytest
+
+from grimoire.core.metadata import FLOAT, OBJECT, MetadataStore
+from grimoire.core.vocab import StringStore
+
+
+def store():
+    return MetadataStore(StringStore())
+
+
+def test_ints_outside_int64_do_not_misalign_columns():
+    metadata = store()
+    metadata.append({"a": 1, "n": 1})
+    metadata.create_index("a")
+    metadata.append({"a": 2, "n": 2 ** 64})
+    metadata.append({"a": 3, "n": -2 ** 63 - 1})
+
+    assert metadata.num_rows == 3
+    assert all(len(column) == 3 for column in metadata.columns.values())
+    assert metadata.columns["n"].dtype == OBJECT
+    assert metadata.get(1, "n") == 2 ** 64
+    assert metadata.query(a=3) == [2]
+    assert metadata.query(n=2 ** 64) == [1]
+
+
+def test_update_with_an_int_outside_int64():
+    metadata = store()
+    metadata.append({"a": 1, "n": 1})
+    metadata.create_index("a")
+    metadata.append({"a": 2, "n": 2})
+    metadata.update(0, {"a": 5, "n": 2 ** 64})
+
+    assert metadata.get(0, "n") == 2 ** 64
+    assert metadata.get(1, "n") == 2
+    assert metadata.query(a=5) == [0]
+    assert metadata.query(a=1) == []
+
+
+def test_update_moves_rows_between_hash_postings():
+    metadata = store()
+    for i in range(1000):
+        metadata.append({"doc_type": "memo" if i % 2 else "letter"})
+    metadata.create_index("doc_type")
+
+    for row in range(0, 1000, 10):
+        metadata.update(row, {"doc_type": "report"})
+
+    assert metadata.query(doc_type="report") == list(range(0, 1000, 10))
+    assert len(metadata.query(doc_type="letter")) == 400
+    assert len(metadata.query(doc_type="memo")) == 500
+
+
+ROWS = [
+    {"n": 3, "x": 1.5, "kind": "memo", "flag": True, "when": "2020-01-02"},
+    {"n": 1, "x": -2.0, "kind": "letter", "flag": False, "when": "2021-06-30"},
+    {"n": 7, "kind": "memo", "when": "2019-12-31"},
+    {"x": 0.0, "kind": "report", "flag": True},
+    {"n": 3, "x": 9.25, "flag": False, "when": "2020-01-02"},
+    {},
+]
+
+CASES = [
+    ({"n": 3}, lambda row: row.get("n") == 3),
+    ({"n__ne": 3}, lambda row: row.get("n") is not None and row["n"] != 3),
+    ({"n__gt": 1}, lambda row: row.get("n") is not None and row["n"] > 1),
+    ({"n__gte": 3}, lambda row: row.get("n") is not None and row["n"] >= 3),
+    ({"n__lt": 7}, lambda row: row.get("n") is not None and row["n"] < 7),
+    ({"n__lte": 3}, lambda row: row.get("n") is not None and row["n"] <= 3),
+    ({"n__in": [1, 7, 99]}, lambda row: row.get("n") in (1, 7)),
+    ({"n__isnull": True}, lambda row: row.get("n") is None),
+    ({"n__isnull": False}, lambda row: row.get("n") is not None),
+    ({"x__gt": 0}, lambda row: row.get("x") is not None and row["x"] > 0),
+    ({"x": 0.0}, lambda row: row.get("x") == 0.0),
+    ({"kind": "memo"}, lambda row: row.get("kind") == "memo"),
+    ({"kind": "missing"}, lambda row: False),
+    ({"kind__ne": "memo"}, lambda row: row.get("kind") is not None and row["kind"] != "memo"),
+    ({"kind__in": ["memo", "report"]}, lambda row: row.get("kind") in ("memo", "report")),
+    ({"kind__contains": "e"}, lambda row: "e" in (row.get("kind") or "")),
+    ({"flag": True}, lambda row: row.get("flag") is True),
+    ({"when__gte": "2020-01-01"}, lambda row: row.get("when") is not None and row["when"] >= "2020-01-01"),
+    ({"when": "2020-01-02"}, lambda row: row.get("when") == "2020-01-02"),
+    ({"n": 3, "kind": "memo"}, lambda row: row.get("n") == 3 and row.get("kind") == "memo"),
+    ({"unknown": 1}, lambda row: False),
+    ({"unknown__isnull": True}, lambda row: True),
+]
+
+
+def filled(kinds):
+    metadata = store()
+    metadata.append_many(ROWS)
+    for name in ("n", "x", "kind", "flag", "when"):
+        for kind in kinds:
+            metadata.create_index(name, kind)
+    return metadata
+
+
+@pytest.mark.parametrize("kinds", [(), ("hash",), ("sorted",), ("hash", "sorted")])
+@pytest.mark.parametrize("conditions, expected", CASES)
+def test_query_matches_a_scan(kinds, conditions, expected):
+    metadata = filled(kinds)
+    assert metadata.query(**conditions) == [i for i, row in enumerate(ROWS) if expected(row)]
+
+
+@pytest.mark.parametrize("kinds", [(), ("hash",), ("sorted",)])
+def test_query_after_appends_and_updates(kinds):
+    metadata = filled(kinds)
+    metadata.append({"n": 3, "kind": "memo"})
+    metadata.update(0, {"n": 4, "kind": "letter"})
+    metadata.update(2, {})
+
+    assert metadata.query(n=3) == [4, 6]
+    assert metadata.query(n__gte=4) == [0]
+    assert metadata.query(kind="memo") == [6]
+    assert metadata.query(kind="letter") == [0, 1]
+    assert metadata.query(n__isnull=True) == [2, 3, 5]
+    assert metadata.get(0, "x") is None
+
+
+def test_int_column_widens_to_float():
+    metadata = store()
+    metadata.append({"n": 1})
+    metadata.create_index("n", "sorted")
+    metadata.append({"n": 2.5})
+
+    assert metadata.columns["n"].dtype == FLOAT
+    assert metadata.query(n__gt=1) == [1]
+    assert metadata.query(n=1) == [0]
+
+
+def test_column_widens_to_object_and_drops_indexes():
+    metadata = store()
+    metadata.append({"tags": "a"})
+    metadata.create_index("tags")
+    metadata.append({"tags": ["a", "b"]})
+    metadata.update(0, {"tags": {"k": 1}})
+
+    assert metadata.columns["tags"].dtype == OBJECT
+    assert "tags" not in metadata.indexes
+    assert metadata.query(tags=["a", "b"]) == [1]
+    assert metadata.query(tags__contains="k") == [0]
+    assert all(len(column) == metadata.num_rows for column in metadata.columns.values())
+
+    with pytest.raises(ValueError):
+        metadata.create_index("tags")
+
+
+def test_take_keeps_values_and_indexes():
+    metadata = filled(("hash",))
+    taken = metadata.take([4, 0])
+
+    assert len(taken) == 2
+    assert taken.query(n=3) == [0, 1]
+    assert taken.get(0, "x") == 9.25
+    assert "hash" in taken.indexes["kind"]
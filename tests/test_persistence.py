@@ -0,0 +1,135 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from grimoire.core import persistence
+from grimoire.core.persistence import MANIFEST, SegmentLog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def save_base(log, corpus, wait=True):
+    state = {key: 1 for key in corpus}
+    log.submit(log.write_base("corpus", pickle.dumps(corpus), state), wait)
+    return state
+
+
+def save_segment(log, added, wait=True):
+    state = dict(log.pending, **{key: 1 for key in added})
+    job = log.write_segment(lambda: {"added": added}, log.pending, state)
+    assert job is not None
+    log.submit(job, wait)
+
+
+def block(log):
+    # Holds the writer thread until the returned event is set, so later jobs queue up behind it
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+
+    log.submit(job)
+    started.wait(5)
+    return release
+
+
+def test_segment_round_trip(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    save_base(log, {"D1": "one"})
+    save_segment(log, {"D2": "two"})
+    save_segment(log, {"D3": "three"})
+
+    corpus, segments = SegmentLog(str(tmp_path)).read()
+
+    assert corpus == {"D1": "one"}
+    assert segments == [{"added": {"D2": "two"}}, {"added": {"D3": "three"}}]
+    assert log.persisted == {"D1": 1, "D2": 1, "D3": 1}
+
+
+def test_failed_write_drops_queued_segments(tmp_path, monkeypatch):
+    log = SegmentLog(str(tmp_path))
+    save_base(log, {"D1": "one"})
+    write_atomic = persistence.write_atomic
+
+    def fail_segments(path, data):
+        if os.path.basename(path).startswith("segment"):
+            raise OSError("disk full")
+        write_atomic(path, data)
+
+    release = block(log)
+    save_segment(log, {"D7": "seven"}, wait=False)
+    monkeypatch.setattr(persistence, "write_atomic", fail_segments)
+    # Queued behind the segment that is about to fail, and only holds the changes made after it
+    save_segment(log, {"D8": "eight"}, wait=False)
+    release.set()
+
+    with pytest.raises(OSError):
+        log.flush()
+
+    monkeypatch.setattr(persistence, "write_atomic", write_atomic)
+
+    assert manifest(str(tmp_path))["segments"] == []
+    assert log.persisted is None
+    assert log.pending is None
+    # Nothing can be appended until a full base has been written again
+    assert log.write_segment(dict, log.pending, {}) is None
+
+    save_base(log, {"D1": "one", "D7": "seven", "D8": "eight"})
+    corpus, segments = log.read()
+    assert corpus == {"D1": "one", "D7": "seven", "D8": "eight"}
+    assert segments == []
+
+
+def test_segment_prepared_before_failure_is_refused(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    save_base(log, {"D1": "one"})
+    since = log.pending
+
+    def fail():
+        raise OSError("disk full")
+
+    log.submit(fail)
+    with pytest.raises(OSError):
+        log.flush()
+
+    assert log.write_segment(dict, since, dict(since, D2=1)) is None
+
+
+def test_compaction_replaces_base_and_segments(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    save_base(log, {"D1": "one"})
+    save_segment(log, {"D2": "two"})
+    old = manifest(str(tmp_path))
+
+    save_base(log, {"D1": "one", "D2": "two"})
+    new = manifest(str(tmp_path))
+
+    assert new["segments"] == []
+    assert new["base"] != old["base"]
+    assert sorted(os.listdir(str(tmp_path))) == sorted([MANIFEST, new["base"]])
+    assert log.read() == ({"D1": "one", "D2": "two"}, [])
+
+
+def test_queued_writes_finish_at_exit(tmp_path):
+    script = (
+        "import pickle\n"
+        "from grimoire.core.persistence import open_log\n"
+        f"log = open_log({str(tmp_path)!r})\n"
+        "log.submit(log.write_base('corpus', pickle.dumps({'D1': 'one'}), {'D1': 1}), wait=True)\n"
+        "job = log.write_segment(lambda: {'added': {'D2': 'two'}}, log.pending, {'D1': 1, 'D2': 1})\n"
+        "log.submit(job)\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True)
+
+    assert len(manifest(str(tmp_path))["segments"]) == 1
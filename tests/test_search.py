@@ -0,0 +1,74 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from grimoire.core import search
+from grimoire.core.search import PatternMatcher, SearchCache, scan
+
+
+@pytest.fixture
+def automaton(monkeypatch):
+    # Forces the pure Python automaton, whatever is installed and however few patterns there are
+    monkeypatch.setattr(search, "ahocorasick", None)
+    monkeypatch.setattr(PatternMatcher, "AUTOMATON_MIN", 0)
+
+
+def brute_force(patterns, text):
+    return {i for i, pattern in enumerate(patterns) if pattern and pattern in text}
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_automaton_matches_substring_search(automaton, seed):
+    rng = random.Random(seed)
+    alphabet = "abc"
+    patterns = list(dict.fromkeys(
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(40)
+    ))
+    matcher = PatternMatcher(patterns)
+
+    for _ in range(20):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert matcher.matches(text) == brute_force(matcher.patterns, text)
+
+
+def test_automaton_follows_failure_links(automaton):
+    patterns = ["he", "she", "his", "hers", "e", ""]
+    matcher = PatternMatcher(patterns)
+
+    assert matcher.matches("ushers") == brute_force(patterns, "ushers") == {0, 1, 3, 4}
+    assert matcher.matches("") == set()
+
+
+def test_small_pattern_sets_use_substring_search(monkeypatch):
+    monkeypatch.setattr(search, "ahocorasick", None)
+    patterns = ["memo", "letter", "emo"]
+    matcher = PatternMatcher(patterns)
+
+    assert matcher.matches("a memorandum") == {0, 2}
+
+
+def document(document_id, text):
+    return SimpleNamespace(id=document_id, text=text)
+
+
+def test_scan_answers_every_query():
+    documents = [document(1, "The Quick fox"), document(2, "a lazy dog"), document(3, None)]
+    hits = scan(documents, ["quick", "dog", "o", "", "cat"])
+
+    assert hits == {"quick": (1,), "dog": (2,), "o": (1, 2), "": (1, 2), "cat": ()}
+
+
+def test_cache_follows_added_and_removed_documents():
+    cache = SearchCache(cache_size=2)
+    cache.put("fox", (1,))
+    cache.add_documents([document(4, "another fox")])
+    assert cache.get("fox") == (1, 4)
+
+    cache.remove_documents([1])
+    assert cache.get("fox") == (4,)
+
+    cache.put("dog", ())
+    cache.put("cat", ())
+    assert cache.get("fox") is None
+    assert len(cache) == 2
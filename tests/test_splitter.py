@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from grimoire.nlp.splitter import Splitter, Window
+
+
+def check_windows(splitter, text, windows):
+    # Cores tile the text exactly, and each window is its core plus at most overlap either side
+    assert windows[0].core_start == 0
+    assert windows[-1].core_end == len(text)
+
+    for previous, window in zip(windows, windows[1:]):
+        assert window.core_start == previous.core_end
+
+    for window in windows:
+        assert window.start <= window.core_start < window.core_end <= window.end
+        assert window.core_end - window.core_start <= splitter.max_chars
+        assert window.core_start - window.start <= splitter.overlap
+        assert window.end - window.core_end <= splitter.overlap
+
+
+def random_text(rng, paragraphs):
+    words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    return "\n\n".join(
+        " ".join(
+            " ".join(rng.choice(words) for _ in range(rng.randint(3, 15))) + "."
+            for _ in range(rng.randint(1, 8))
+        )
+        for _ in range(paragraphs)
+    )
+
+
+def test_short_text_is_one_window():
+    text = "A short text."
+    assert Splitter(max_chars=100).split(text) == [Window(0, len(text), 0, len(text))]
+
+
+@pytest.mark.parametrize("unit", ["paragraph", "sentence"])
+@pytest.mark.parametrize("seed", range(10))
+def test_windows_cover_the_text(unit, seed):
+    rng = random.Random(seed)
+    splitter = Splitter(max_chars=300, overlap=40, unit=unit)
+    text = random_text(rng, 30)
+
+    windows = splitter.split(text)
+    assert len(windows) > 1
+    check_windows(splitter, text, windows)
+
+
+def test_cores_end_on_paragraph_breaks():
+    paragraph = "word " * 15 + "end."
+    text = "\n\n".join([paragraph] * 10)
+    splitter = Splitter(max_chars=200, overlap=20)
+
+    windows = splitter.split(text)
+    check_windows(splitter, text, windows)
+
+    for window in windows[:-1]:
+        assert text[:window.core_end].endswith("\n\n")
+
+
+def test_text_without_breaks_is_cut_on_whitespace():
+    text = " ".join(["word"] * 200)
+    splitter = Splitter(max_chars=50, overlap=10)
+
+    windows = splitter.split(text)
+    check_windows(splitter, text, windows)
+
+    for window in windows[:-1]:
+        assert text[window.core_end - 1].isspace()
+
+
+def test_text_without_whitespace_is_cut_at_the_limit():
+    text = "x" * 1000
+    splitter = Splitter(max_chars=300, overlap=10)
+
+    windows = splitter.split(text)
+    check_windows(splitter, text, windows)
+    assert [window.core_end for window in windows] == [300, 600, 900, 1000]
+
+
+def test_unknown_unit_is_rejected():
+    with pytest.raises(ValueError):
+        Splitter(unit="word")